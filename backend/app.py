@@ -1,55 +1,388 @@
-from flask import Flask, request, jsonify, render_template, Response, redirect, url_for, session
+from flask import Flask, Blueprint, current_app, g, request, jsonify, render_template, Response, redirect, url_for, session, stream_with_context, send_file
 from flask_cors import CORS
-from pymongo import MongoClient
-from bson import ObjectId
-from datetime import datetime
+from pymongo import MongoClient, ReturnDocument, UpdateOne, ReplaceOne, CursorType
+from pymongo.errors import DuplicateKeyError, CollectionInvalid, BulkWriteError
+from pymongo import monitoring
+from pymongo.read_preferences import Primary, PrimaryPreferred, Secondary, SecondaryPreferred, Nearest
+from bson import ObjectId, json_util
+from werkzeug.local import LocalProxy
+from datetime import datetime, timedelta
 from werkzeug.security import generate_password_hash, check_password_hash
 import pytz
 import csv
-from io import StringIO
+import io
 import traceback
+import os
+import json
+import hashlib
+import hmac
+import time
+import uuid
+import queue
+import random
+import collections
+import smtplib
+from email.message import EmailMessage
+from urllib.parse import urlencode
+from statistics import NormalDist
+import threading
+import functools
+import itertools
+import heapq
+import base64
+import gzip
+import zlib
+import click
+from concurrent.futures import ThreadPoolExecutor
+from storage import EXPORT_BATCH_SIZE, MongoHooks, MongoStorage, SqliteStorage
+
+try:
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import A4, landscape
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+except ImportError:
+    SimpleDocTemplate = None
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 # ================= APP =================
-app = Flask(__name__)
-
-# CORS Configuration - More permissive for development
-CORS(app, 
-     supports_credentials=True,
-     origins=["http://127.0.0.1:5000", "http://localhost:5000"],
-     allow_headers=["Content-Type", "Authorization"],
-     methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"])
-
-# Secret key for sessions
-app.secret_key = "smartstock_secret_key_2026"
-
-# Session configuration
-app.config.update(
-    SESSION_COOKIE_SAMESITE="Lax",
-    SESSION_COOKIE_SECURE=False,
-    SESSION_COOKIE_HTTPONLY=True,
-    PERMANENT_SESSION_LIFETIME=3600  # 1 hour
-)
+# Routes live on a blueprint; create_app() builds and configures the app.
+# cli_group=None keeps commands at the top level (flask rebuild-summary, ...).
+bp = Blueprint("smartstock", __name__, cli_group=None)
+
+DEFAULT_CONFIG = {
+    # "mongo" (default) or "sqlite" for a single-process store in one file
+    "STORAGE_BACKEND": os.environ.get("STORAGE_BACKEND", "mongo"),
+    "SQLITE_PATH": os.environ.get(
+        "SQLITE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "smartstock.sqlite3")
+    ),
+
+    # Secret key for sessions
+    "SECRET_KEY": os.environ.get("SECRET_KEY", "smartstock_secret_key_2026"),
+
+    # Session configuration
+    "SESSION_COOKIE_SAMESITE": "Lax",
+    "SESSION_COOKIE_SECURE": False,
+    "SESSION_COOKIE_HTTPONLY": True,
+    "PERMANENT_SESSION_LIFETIME": 3600,  # 1 hour
+
+    # MongoDB connection and pool settings
+    "MONGO_URI": os.environ.get("MONGO_URI", "mongodb://localhost:27017"),
+    "MONGO_DB": os.environ.get("MONGO_DB", "smartstock"),
+    "MONGO_MAX_POOL_SIZE": int(os.environ.get("MONGO_MAX_POOL_SIZE", 50)),
+    "MONGO_MIN_POOL_SIZE": int(os.environ.get("MONGO_MIN_POOL_SIZE", 0)),
+    "MONGO_MAX_IDLE_TIME_MS": int(os.environ.get("MONGO_MAX_IDLE_TIME_MS", 60000)),
+    "MONGO_SERVER_SELECTION_TIMEOUT_MS": int(os.environ.get("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000)),
+    "MONGO_CONNECT_TIMEOUT_MS": int(os.environ.get("MONGO_CONNECT_TIMEOUT_MS", 5000)),
+    "MONGO_SOCKET_TIMEOUT_MS": int(os.environ.get("MONGO_SOCKET_TIMEOUT_MS", 30000)),
+    "MONGO_WAIT_QUEUE_TIMEOUT_MS": int(os.environ.get("MONGO_WAIT_QUEUE_TIMEOUT_MS", 10000)),
+    # Log database commands slower than this (ms); unset disables the slow-query log
+    "MONGO_SLOW_QUERY_MS": float(os.environ["MONGO_SLOW_QUERY_MS"]) if os.environ.get("MONGO_SLOW_QUERY_MS") else None,
+    # Read preference per route class (see READ_ROUTES), as "mode" or
+    # "mode:maxStalenessSeconds" (at least 90). Writes always go to the primary.
+    "MONGO_READ_DASHBOARD": os.environ.get("MONGO_READ_DASHBOARD", "primary"),
+    "MONGO_READ_REPORTS": os.environ.get("MONGO_READ_REPORTS", "secondaryPreferred:90"),
+
+    # Outgoing mail for low-stock alerts (defaults suit a local SMTP stand-in,
+    # e.g. `python -m aiosmtpd -n -l localhost:1025`)
+    "SMTP_HOST": os.environ.get("SMTP_HOST", "localhost"),
+    "SMTP_PORT": int(os.environ.get("SMTP_PORT", 1025)),
+    "SMTP_USER": os.environ.get("SMTP_USER", ""),
+    "SMTP_PASSWORD": os.environ.get("SMTP_PASSWORD", ""),
+    "SMTP_USE_TLS": os.environ.get("SMTP_USE_TLS", "0") == "1",
+    "ALERT_FROM": os.environ.get("ALERT_FROM", "smartstock@localhost"),
+    "ALERT_TO": [a for a in os.environ.get("ALERT_TO", "").split(",") if a],
+
+    # Ledger rows older than this many whole months are moved to the archive
+    # by `flask archive-transactions`
+    "ARCHIVE_RETENTION_MONTHS": int(os.environ.get("ARCHIVE_RETENTION_MONTHS", 12)),
+
+    # Open /api/events streams allowed per process; further clients are told to
+    # reconnect later. Unset: 1000 under gevent workers (see gunicorn.conf.py),
+    # 100 otherwise, where each stream holds a worker thread.
+    "EVENT_STREAMS_MAX": int(os.environ["EVENT_STREAMS_MAX"]) if os.environ.get("EVENT_STREAMS_MAX") else None,
+
+    # /metrics is open to admins; a scraper authenticates with
+    # "Authorization: Bearer <METRICS_TOKEN>" (unset: admins only)
+    "METRICS_TOKEN": os.environ.get("METRICS_TOKEN", "")
+}
 
 # ================= DATABASE =================
-try:
-    client = MongoClient("mongodb://localhost:27017", serverSelectionTimeoutMS=5000)
-    # Test connection
-    client.server_info()
-    print("✅ MongoDB connected successfully")
-    
-    db = client["smartstock"]
-    products = db["products"]
-    transactions = db["transactions"]
-    users = db["users"]
-    
-    # Create indexes for better performance
+# _id of the materialized inventory summary document in the "stats" collection
+SUMMARY_ID = "inventory"
+# _id of the "stats" counter that numbers change events (the SSE id)
+EVENT_SEQ_ID = "event_seq"
+
+# Stored bulk responses are replayed for retries within this window
+IDEMPOTENCY_TTL_SECONDS = 24 * 3600
+
+# Finished report jobs are forgotten after this long; cached files outlive them
+REPORT_JOB_TTL_SECONDS = 7 * 24 * 3600
+
+# Size of the capped "events" collection behind /api/events
+EVENTS_CAP_BYTES = 16 * 1024 * 1024
+EVENTS_CAP_DOCS = 100000
+
+# Equality filters accepted by /api/transactions. Every combination gets a
+# compound index ending in (date, _id) so keyset pages never sort in memory.
+TRANSACTION_FILTER_FIELDS = ("product_id", "type", "user")
+
+def transaction_indexes():
+    indexes = [[("date", -1), ("_id", -1)]]
+    for size in range(1, len(TRANSACTION_FILTER_FIELDS) + 1):
+        for fields in itertools.combinations(TRANSACTION_FILTER_FIELDS, size):
+            indexes.append([(f, 1) for f in fields] + [("date", -1), ("_id", -1)])
+    return indexes
+
+# /api/products sort keys (stored field per key) and equality filters. Every
+# stock movement rewrites quantity and stockValue, and each index holding one
+# of them costs an extra entry update per movement. So each sort key gets one
+# index of its own, and each filter is indexed only with the default name
+# sort. A filtered page sorted by quantity or value reads the filter's range
+# and sorts that subset in memory.
+PRODUCT_SORT_FIELDS = {"name": "name", "quantity": "quantity", "value": "stockValue"}
+PRODUCT_FILTER_FIELDS = ("category", "supplier", "stockLevel")
+
+def product_indexes():
+    indexes = [[(sort_field, 1), ("_id", 1)] for sort_field in PRODUCT_SORT_FIELDS.values()]
+    for f in PRODUCT_FILTER_FIELDS:
+        indexes.append([(f, 1), ("name", 1), ("_id", 1)])
+    return indexes
+
+def retired_product_indexes():
+    # Index names (MongoDB's default "<field>_<dir>_...") of the filter x
+    # moving-sort indexes earlier versions created
+    return [f"{f}_1_{sort_field}_1__id_1"
+            for sort_field in ("quantity", "stockValue") for f in PRODUCT_FILTER_FIELDS]
+
+# Per-app state (Mongo client, storage backend, catalog cache, event
+# subscribers, background thread pids) is kept on app.extensions by
+# create_app, so two apps in one process never share it.
+# Threads that outlive a request enter the app context through
+# run_with_app_context().
+def app_state():
+    return current_app.extensions["smartstock"]
+
+def run_with_app_context(app, target, *args):
+    with app.app_context():
+        return target(*args)
+
+# One MongoClient per app and process, created on first use. PyMongo clients
+# are not fork-safe, so a process that finds a client created by its parent
+# (pre-fork servers) builds its own instead of reusing the inherited sockets.
+mongo_lock = threading.Lock()
+
+def get_client():
+    mongo = app_state()["mongo"]
+    if mongo["pid"] != os.getpid():
+        with mongo_lock:
+            if mongo["pid"] != os.getpid():
+                cfg = mongo["config"]
+                mongo["client"] = MongoClient(
+                    cfg["MONGO_URI"],
+                    maxPoolSize=cfg["MONGO_MAX_POOL_SIZE"],
+                    minPoolSize=cfg["MONGO_MIN_POOL_SIZE"],
+                    maxIdleTimeMS=cfg["MONGO_MAX_IDLE_TIME_MS"],
+                    serverSelectionTimeoutMS=cfg["MONGO_SERVER_SELECTION_TIMEOUT_MS"],
+                    connectTimeoutMS=cfg["MONGO_CONNECT_TIMEOUT_MS"],
+                    socketTimeoutMS=cfg["MONGO_SOCKET_TIMEOUT_MS"],
+                    waitQueueTimeoutMS=cfg["MONGO_WAIT_QUEUE_TIMEOUT_MS"],
+                    event_listeners=[MongoCommandMetrics(cfg["MONGO_SLOW_QUERY_MS"]), MongoPoolMetrics()],
+                    connect=False
+                )
+                mongo["pid"] = os.getpid()
+    return mongo["client"]
+
+def get_db():
+    # Reads on this thread follow the route class set by route_reads()
+    mongo = app_state()["mongo"]
+    pref = mongo["read_preferences"].get(getattr(read_routing, "route", None))
+    if pref is None:
+        return get_client()[mongo["config"]["MONGO_DB"]]
+    return get_client().get_database(mongo["config"]["MONGO_DB"], read_preference=pref)
+
+def collection(name):
+    # Resolved on every use, so nothing touches the network at import time
+    return LocalProxy(lambda: get_db()[name])
+
+products = collection("products")
+transactions = collection("transactions")
+# Cold tier of the ledger, see `flask archive-transactions`
+transactions_archive = collection("transactions_archive")
+opening_balances = collection("opening_balances")
+# Per-product quantities as of each snapshot time, see `flask snapshot-inventory`
+inventory_snapshots = collection("inventory_snapshots")
+snapshot_runs = collection("snapshot_runs")
+# `flask reconcile-stock` runs and what they found
+reconcile_runs = collection("reconcile_runs")
+reconcile_findings = collection("reconcile_findings")
+# Output of `flask forecast-reorder`, one document per product
+reorder_forecasts = collection("reorder_forecasts")
+users = collection("users")
+stats = collection("stats")
+bulk_requests = collection("bulk_requests")
+report_jobs = collection("report_jobs")
+alert_outbox = collection("alert_outbox")
+email_logs = collection("email_logs")
+daily_rollups = collection("daily_rollups")
+# Capped change feed tailed by every process to push live dashboard updates
+events = collection("events")
+
+def create_indexes():
+    db = get_db()
+    try:
+        db.create_collection("events", capped=True, size=EVENTS_CAP_BYTES, max=EVENTS_CAP_DOCS)
+    except CollectionInvalid:
+        pass
+    events.create_index("seq")
+
     users.create_index("email", unique=True)
-    products.create_index("name")
-    transactions.create_index("date")
-    
-except Exception as e:
-    print(f"❌ MongoDB connection failed: {e}")
-    print("Please ensure MongoDB is running on localhost:27017")
+    for keys in product_indexes():
+        products.create_index(keys)
+    existing = products.index_information()
+    for name in retired_product_indexes():
+        if name in existing:
+            products.drop_index(name)
+    products.create_index("nameKey")
+    products.create_index("sku", unique=True, partialFilterExpression={"sku": {"$type": "string"}})
+    products.create_index(
+        [("name", "text"), ("category", "text"), ("supplier", "text")],
+        weights=SEARCH_WEIGHTS, name="product_search"
+    )
+    for keys in transaction_indexes():
+        transactions.create_index(keys)
+    bulk_requests.create_index("createdAt", expireAfterSeconds=IDEMPOTENCY_TTL_SECONDS)
+    report_jobs.create_index("createdAt", expireAfterSeconds=REPORT_JOB_TTL_SECONDS)
+    alert_outbox.create_index([("status", 1), ("createdAt", 1)])
+    alert_outbox.create_index("claim")
+    email_logs.create_index([("sentAt", -1)])
+    daily_rollups.create_index([("day", 1), ("product_id", 1)], unique=True)
+    daily_rollups.create_index([("product_id", 1), ("day", 1)])
+    # The archive is read rarely, so it only carries the date and product paths
+    transactions_archive.create_index([("date", -1), ("_id", -1)])
+    transactions_archive.create_index([("product_id", 1), ("date", -1), ("_id", -1)])
+    opening_balances.create_index([("product_id", 1), ("month", 1)], unique=True)
+    inventory_snapshots.create_index([("at", 1), ("product_id", 1)], unique=True)
+    inventory_snapshots.create_index([("at", 1), ("productName", 1)])
+    products.create_index("createdAt")
+    reconcile_findings.create_index([("run", 1), ("product_id", 1)], unique=True)
+    reorder_forecasts.create_index([("daysToStockout", 1), ("_id", 1)])
+
+@bp.cli.command("migrate")
+def migrate_command():
+    """Create collections / tables and indexes (run once per deploy, not per worker)."""
+    get_storage().create_schema()
+    print(f"✅ {get_storage().name} schema and indexes are up to date")
+
+# =====================================================
+# 🧭 READ ROUTING (replica-set members)
+# =====================================================
+# Read-heavy routes are grouped into classes with their own read preference
+# (MONGO_READ_DASHBOARD, MONGO_READ_REPORTS), so on a replica set dashboards,
+# exports and reports can be served by secondaries while stock movements keep
+# the primary. Everything else, writes included, stays on the primary.
+#
+# A secondary may lag, so once dashboards leave the primary a user must still
+# see their own stock movements: write routes then run in a causally
+# consistent session whose operation time is kept in the (signed) session
+# cookie, and that user's dashboard reads run in a session advanced to it, so
+# a lagging member waits until it has replicated the write before answering.
+# Try it on a local replica set, e.g. three `mongod --replSet rs0` members and
+# MONGO_URI=mongodb://localhost:27017,localhost:27018,localhost:27019/?replicaSet=rs0
+READ_ROUTES = {
+    "dashboard": ("get_products", "search_products", "get_transactions", "low_stock",
+                  "inventory_value", "get_stats", "get_users"),
+    "reports": ("export_inventory_csv", "export_transactions_csv", "movement_summary",
+                "inventory_as_of_route", "reorder_suggestions")
+}
+READ_ROUTE_ENDPOINTS = {f"{bp.name}.{name}": route for route, names in READ_ROUTES.items() for name in names}
+CAUSAL_WRITE_ENDPOINTS = {f"{bp.name}.{name}" for name in (
+    "add_transaction", "bulk_add_transactions", "add_product", "delete_product", "import_products_route"
+)}
+READ_PREFERENCE_MODES = {
+    "primary": Primary,
+    "primaryPreferred": PrimaryPreferred,
+    "secondary": Secondary,
+    "secondaryPreferred": SecondaryPreferred,
+    "nearest": Nearest
+}
+# Key of the last write's cluster / operation time in the Flask session
+CAUSAL_TOKEN_KEY = "causal"
+
+# Route class of the current request (or report job) on this thread
+read_routing = threading.local()
+
+def read_preference(spec):
+    """Parse "mode[:maxStalenessSeconds]"; None means the primary."""
+    mode, _, staleness = spec.partition(":")
+    if mode not in READ_PREFERENCE_MODES:
+        raise ValueError(f"Unknown read preference: {mode}")
+    if mode == "primary":
+        if staleness:
+            raise ValueError("primary reads take no max staleness")
+        return None
+    return READ_PREFERENCE_MODES[mode](max_staleness=int(staleness) if staleness else -1)
+
+def read_preferences(config):
+    return {route: read_preference(config[f"MONGO_READ_{route.upper()}"]) for route in READ_ROUTES}
+
+def causal_reads():
+    # Only needed when a user's dashboard reads may land on a lagging member
+    return app_state()["mongo"]["read_preferences"].get("dashboard") is not None and uses_mongo()
+
+def start_causal_session(token=None):
+    db_session = get_client().start_session(causal_consistency=True)
+    if token:
+        token = json_util.loads(token)
+        db_session.advance_cluster_time(token["clusterTime"])
+        db_session.advance_operation_time(token["operationTime"])
+    # bind() passes the session to every operation on this thread implicitly
+    g.mongo_session = db_session
+    g.mongo_session_binding = db_session.bind()
+    g.mongo_session_binding.__enter__()
+
+@bp.before_app_request
+def route_reads():
+    read_routing.route = READ_ROUTE_ENDPOINTS.get(request.endpoint)
+    if not causal_reads():
+        return
+    if request.endpoint in CAUSAL_WRITE_ENDPOINTS:
+        start_causal_session()
+    elif read_routing.route == "dashboard" and session.get(CAUSAL_TOKEN_KEY):
+        start_causal_session(session[CAUSAL_TOKEN_KEY])
+
+@bp.after_app_request
+def remember_causal_token(response):
+    db_session = g.get("mongo_session")
+    if (db_session is not None and request.endpoint in CAUSAL_WRITE_ENDPOINTS
+            and db_session.cluster_time and db_session.operation_time):
+        session[CAUSAL_TOKEN_KEY] = json_util.dumps({
+            "clusterTime": db_session.cluster_time,
+            "operationTime": db_session.operation_time
+        })
+    return response
+
+@bp.teardown_app_request
+def end_causal_session(exc):
+    read_routing.route = None
+    binding = g.pop("mongo_session_binding", None)
+    g.pop("mongo_session", None)
+    if binding is not None:
+        binding.__exit__(None, None, None)
 
 # =====================================================
 # 🔐 HELPERS
@@ -60,21 +393,301 @@ def login_required():
 def admin_required():
     return "email" in session and session.get("role") == "admin"
 
+def is_low_stock(quantity, threshold):
+    return threshold > 0 and quantity <= threshold
+
+# =====================================================
+# 📦 RESPONSE ENCODING (JSON, columns, compression)
+# =====================================================
+# List responses are encoded with orjson when it is installed (the stdlib
+# encoder otherwise). Text responses of at least COMPRESS_MIN_BYTES go out
+# brotli- or gzip-compressed when the client accepts it; smaller ones cost
+# more to compress than they save. Streamed CSV exports are compressed chunk
+# by chunk. Compressed responses carry a weak ETag, so If-None-Match keeps
+# working across encodings.
+#
+# List endpoints also take ?format=columns for a compact columnar body,
+# {"count": n, "columns": {field: [values, ...]}}, which names each field once
+# instead of once per row.
+COMPRESS_MIN_BYTES = 1024
+COMPRESS_LEVELS = {"br": 4, "gzip": 6}
+COMPRESSIBLE_MIMETYPES = {
+    "application/json", "text/csv", "text/html", "text/plain", "text/css", "application/javascript"
+}
+
+def dump_json(data):
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(",", ":")).encode()
+
+def list_json(records, fields):
+    """Body for a list endpoint: the records, or their columns with ?format=columns."""
+    if request.args.get("format") == "columns":
+        return dump_json({"count": len(records), "columns": {f: [r[f] for r in records] for f in fields}})
+    return dump_json(records)
+
+def json_response(body, status=200, headers=None):
+    return Response(body, status=status, mimetype="application/json", headers=headers)
+
+def negotiate_encoding():
+    accepted = request.accept_encodings
+    if brotli is not None and accepted["br"]:
+        return "br"
+    if accepted["gzip"]:
+        return "gzip"
+    return None
+
+def compress_body(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=COMPRESS_LEVELS["br"])
+    return gzip.compress(body, compresslevel=COMPRESS_LEVELS["gzip"])
+
+def compress_stream(chunks, encoding):
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=COMPRESS_LEVELS["br"])
+        compress, finish = compressor.process, compressor.finish
+    else:
+        # wbits=31: gzip container
+        compressor = zlib.compressobj(COMPRESS_LEVELS["gzip"], zlib.DEFLATED, 31)
+        compress, finish = compressor.compress, compressor.flush
+    try:
+        for chunk in chunks:
+            data = compress(chunk.encode() if isinstance(chunk, str) else chunk)
+            if data:
+                yield data
+        yield finish()
+    finally:
+        # Closing the wrapped stream ends its request context (stream_with_context)
+        close = getattr(chunks, "close", None)
+        if close:
+            close()
+
+def mark_encoded(response, encoding):
+    response.headers["Content-Encoding"] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+@bp.after_app_request
+def compress_response(response):
+    if (response.status_code != 200 or response.direct_passthrough
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES
+            or "Content-Encoding" in response.headers):
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = negotiate_encoding()
+    if encoding is None:
+        return response
+    if response.is_streamed:
+        response.response = compress_stream(response.response, encoding)
+    else:
+        body = response.get_data()
+        if len(body) < COMPRESS_MIN_BYTES:
+            return response
+        response.set_data(compress_body(body, encoding))
+    return mark_encoded(response, encoding)
+
+# =====================================================
+# 🚦 STOCK LEVELS (indexed low / critical state)
+# =====================================================
+# Every product carries stockLevel = "ok" | "low" | "critical", kept current by
+# the write paths so low-stock queries and counts are served by an index.
+LOW_STOCK_LEVELS = ["low", "critical"]
+# Products at or below their (positive) low-stock threshold
+LOW_STOCK_QUERY = {"stockLevel": {"$in": LOW_STOCK_LEVELS}}
+
+def default_critical_stock(low_stock):
+    return low_stock // 2
+
+def stock_level(quantity, low_stock, critical_stock=None):
+    if low_stock <= 0:
+        return "ok"
+    if critical_stock is None:
+        critical_stock = default_critical_stock(low_stock)
+    if quantity <= critical_stock:
+        return "critical"
+    if quantity <= low_stock:
+        return "low"
+    return "ok"
+
+def stock_level_expr():
+    """Server-side twin of stock_level() for pipeline updates."""
+    qty = {"$ifNull": ["$quantity", 0]}
+    low = {"$ifNull": ["$lowStock", 0]}
+    critical = {"$ifNull": ["$criticalStock", {"$floor": {"$divide": [low, 2]}}]}
+    return {"$switch": {
+        "branches": [
+            {"case": {"$lte": [low, 0]}, "then": "ok"},
+            {"case": {"$lte": [qty, critical]}, "then": "critical"},
+            {"case": {"$lte": [qty, low]}, "then": "low"}
+        ],
+        "default": "ok"
+    }}
+
+def stock_value_expr():
+    # Stored as stockValue so /api/products can sort by value on an index
+    return {"$multiply": [{"$ifNull": ["$quantity", 0]}, {"$ifNull": ["$costPrice", 0]}]}
+
+def stock_update(delta):
+    """Pipeline update that moves quantity by delta and recomputes stockLevel and stockValue atomically."""
+    return [
+        {"$set": {"quantity": {"$add": [{"$ifNull": ["$quantity", 0]}, delta]}}},
+        {"$set": {"stockLevel": stock_level_expr(), "stockValue": stock_value_expr()}}
+    ]
+
+@bp.cli.command("backfill-stock-levels")
+def backfill_stock_levels_command():
+    """Set stockLevel and stockValue on every product (run once after upgrading)."""
+    result = products.update_many({}, [{"$set": {"stockLevel": stock_level_expr(), "stockValue": stock_value_expr()}}])
+    print(f"✅ Stock level recomputed for {result.modified_count} products")
+
+# =====================================================
+# 🧮 INVENTORY SUMMARY (materialized totals)
+# =====================================================
+def rebuild_inventory_summary():
+    """Recompute the inventory summary server-side with a $group aggregation."""
+    qty = {"$ifNull": ["$quantity", 0]}
+    threshold = {"$ifNull": ["$lowStock", 0]}
+
+    grouped = list(products.aggregate([
+        {"$group": {
+            "_id": None,
+            "totalValue": {"$sum": {"$multiply": [qty, {"$ifNull": ["$costPrice", 0]}]}},
+            "productCount": {"$sum": 1},
+            "lowStockCount": {"$sum": {"$cond": [
+                {"$and": [{"$gt": [threshold, 0]}, {"$lte": [qty, threshold]}]}, 1, 0
+            ]}}
+        }}
+    ]))
+
+    totals = grouped[0] if grouped else {}
+    return stats.find_one_and_update(
+        {"_id": SUMMARY_ID},
+        {
+            "$set": {
+                "totalValue": float(totals.get("totalValue", 0)),
+                "productCount": int(totals.get("productCount", 0)),
+                "lowStockCount": int(totals.get("lowStockCount", 0)),
+                "rebuiltAt": datetime.utcnow()
+            },
+            "$inc": {"version": 1}
+        },
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+
+def get_inventory_summary():
+    summary = stats.find_one({"_id": SUMMARY_ID})
+    if not summary:
+        summary = rebuild_inventory_summary()
+    return summary
+
+def bump_inventory_summary(value=0.0, count=0, low=0):
+    # No upsert: if the summary is missing, the next read rebuilds it from scratch
+    stats.update_one(
+        {"_id": SUMMARY_ID},
+        {"$inc": {"totalValue": value, "productCount": count, "lowStockCount": low, "version": 1}}
+    )
+
+def data_version():
+    """Stamp that changes whenever a product or stock write touches the summary."""
+    summary = get_inventory_summary()
+    return f"{int(summary['rebuiltAt'].timestamp())}.{summary.get('version', 0)}"
+
+@bp.cli.command("rebuild-summary")
+def rebuild_summary_command():
+    """Recompute the materialized inventory summary."""
+    summary = rebuild_inventory_summary()
+    print(f"✅ Inventory summary rebuilt: {summary['productCount']} products, "
+          f"{summary['lowStockCount']} low stock, value {round(summary['totalValue'], 2)}")
+
+# =====================================================
+# 🏷️ PRODUCT NAME CACHE
+# =====================================================
+# In-process product_id -> name map used to resolve ledger rows in one batch.
+# It is keyed on its own version in stats, bumped only by product adds,
+# deletes and imports (stock movements never change a name), so a write in
+# any process retires every process's names. The version is re-read at most
+# once per PRODUCT_NAMES_CHECK_SECONDS, not on every history page.
+PRODUCT_NAMES_ID = "product_names"
+PRODUCT_NAME_CACHE_SIZE = 10000
+PRODUCT_NAMES_CHECK_SECONDS = 1.0
+product_name_cache = {"version": None, "checkedAt": 0.0, "names": {}}
+product_name_lock = threading.Lock()
+
+def to_object_id(value):
+    try:
+        return ObjectId(value)
+    except Exception:
+        return None
+
+def bump_product_names():
+    """Retire every process's cached names after an add, delete or import."""
+    state = stats.find_one_and_update(
+        {"_id": PRODUCT_NAMES_ID}, {"$inc": {"version": 1}},
+        upsert=True, return_document=ReturnDocument.AFTER
+    )
+    with product_name_lock:
+        product_name_cache.update(version=state["version"], checkedAt=time.monotonic(), names={})
+
+def product_names_version():
+    now = time.monotonic()
+    with product_name_lock:
+        if now - product_name_cache["checkedAt"] < PRODUCT_NAMES_CHECK_SECONDS:
+            return product_name_cache["version"]
+    state = stats.find_one({"_id": PRODUCT_NAMES_ID}, {"version": 1}) or {}
+    with product_name_lock:
+        product_name_cache["checkedAt"] = now
+    return state.get("version", 0)
+
+def resolve_product_names(product_ids):
+    """Map product ObjectIds to names with at most one batched $in query."""
+    names = {}
+    missing = set()
+    version = product_names_version()
+
+    with product_name_lock:
+        if product_name_cache["version"] != version:
+            product_name_cache.update(version=version, names={})
+        cached = product_name_cache["names"]
+        for pid in product_ids:
+            if pid in cached:
+                names[pid] = cached[pid]
+            else:
+                missing.add(pid)
+
+    if missing:
+        found = {
+            p["_id"]: p.get("name", "Unknown Product")
+            for p in products.find({"_id": {"$in": list(missing)}}, {"name": 1})
+        }
+        names.update(found)
+
+        with product_name_lock:
+            if product_name_cache["version"] == version:
+                cached = product_name_cache["names"]
+                if len(cached) + len(found) > PRODUCT_NAME_CACHE_SIZE:
+                    cached.clear()
+                cached.update(found)
+
+    return names
+
 # =====================================================
 # 🌐 ROOT
 # =====================================================
-@app.route("/")
+@bp.route("/")
 def home():
     return render_template("login.html")
 
-@app.route("/login-page")
+@bp.route("/login-page")
 def login_page():
     return render_template("login.html")
 
 # =====================================================
 # 👤 CURRENT USER
 # =====================================================
-@app.route("/me")
+@bp.route("/me")
 def me():
     if "email" not in session:
         return jsonify({"error": "Not logged in"}), 401
@@ -87,66 +700,66 @@ def me():
 # =====================================================
 # 📄 PAGE ROUTES
 # =====================================================
-@app.route("/admin/dashboard")
+@bp.route("/admin/dashboard")
 def admin_dashboard():
     if not admin_required():
-        return redirect(url_for("login_page"))
+        return redirect(url_for(".login_page"))
     return render_template("admin-dashboard.html")
 
-@app.route("/employee/dashboard")
+@bp.route("/employee/dashboard")
 def employee_dashboard():
     if not login_required():
-        return redirect(url_for("login_page"))
+        return redirect(url_for(".login_page"))
     return render_template("employee-dashboard.html")
 
-@app.route("/products")
+@bp.route("/products")
 def products_page():
     if not login_required():
-        return redirect(url_for("login_page"))
+        return redirect(url_for(".login_page"))
     return render_template("products.html")
 
-@app.route("/add/product")
+@bp.route("/add/product")
 def add_product_page():
     if not admin_required():
-        return redirect(url_for("employee_dashboard"))
+        return redirect(url_for(".employee_dashboard"))
     return render_template("add-product.html")
 
-@app.route("/transactions")
+@bp.route("/transactions")
 def transactions_page():
     if not login_required():
-        return redirect(url_for("login_page"))
+        return redirect(url_for(".login_page"))
     return render_template("transactions.html")
 
-@app.route("/manage/users")
+@bp.route("/manage/users")
 def manage_users_page():
     if not admin_required():
-        return redirect(url_for("employee_dashboard"))
+        return redirect(url_for(".employee_dashboard"))
     return render_template("manage-users.html")
 
-@app.route("/register/employee")
+@bp.route("/register/employee")
 def register_employee_page():
     if not admin_required():
-        return redirect(url_for("employee_dashboard"))
+        return redirect(url_for(".employee_dashboard"))
     return render_template("register-employee.html")
 
-@app.route("/reports")
+@bp.route("/reports")
 def reports_page():
     if not admin_required():
-        return redirect(url_for("employee_dashboard"))
+        return redirect(url_for(".employee_dashboard"))
     return render_template("reports.html")
 
 # =====================================================
 # 🔓 LOGOUT
 # =====================================================
-@app.route("/logout")
+@bp.route("/logout")
 def logout():
     session.clear()
-    return redirect(url_for("login_page"))
+    return redirect(url_for(".login_page"))
 
 # =====================================================
 # 🔐 AUTH API (FIXED WITH BETTER ERROR HANDLING)
 # =====================================================
-@app.route("/login", methods=["POST"])
+@bp.route("/login", methods=["POST"])
 def login():
     try:
         data = request.json
@@ -160,7 +773,7 @@ def login():
         if not email or not password:
             return jsonify({"error": "Email and password are required"}), 400
         
-        user = users.find_one({"email": email})
+        user = get_storage().find_user(email)
         
         if not user:
             return jsonify({"error": "Invalid credentials"}), 401
@@ -186,7 +799,7 @@ def login():
         traceback.print_exc()
         return jsonify({"error": "Server error during login"}), 500
 
-@app.route("/register", methods=["POST"])
+@bp.route("/register", methods=["POST"])
 def register():
     try:
         if not admin_required():
@@ -205,16 +818,15 @@ def register():
         if not email or not name or not password:
             return jsonify({"error": "All fields are required"}), 400
 
-        if users.find_one({"email": email}):
-            return jsonify({"error": "User already exists"}), 409
-
-        users.insert_one({
+        added = get_storage().add_user({
             "name": name,
             "email": email,
             "password": generate_password_hash(password),
             "role": role,
             "createdAt": datetime.utcnow()
         })
+        if not added:
+            return jsonify({"error": "User already exists"}), 409
         
         print(f"✅ New user registered: {email}")
 
@@ -228,14 +840,16 @@ def register():
 # =====================================================
 # 👥 USERS API
 # =====================================================
-@app.route("/users")
+USER_JSON_FIELDS = ["id", "name", "email", "role", "createdAt"]
+
+@bp.route("/users")
 def get_users():
     try:
         if not admin_required():
             return jsonify({"error": "Unauthorized"}), 403
 
         user_list = []
-        for u in users.find():
+        for u in get_storage().list_users():
             user_list.append({
                 "id": str(u["_id"]),
                 "name": u.get("name", ""),
@@ -244,7 +858,7 @@ def get_users():
                 "createdAt": u.get("createdAt", datetime.utcnow()).strftime("%Y-%m-%d")
             })
         
-        return jsonify(user_list), 200
+        return json_response(list_json(user_list, USER_JSON_FIELDS))
         
     except Exception as e:
         print(f"❌ Get users error: {str(e)}")
@@ -253,30 +867,192 @@ def get_users():
 # =====================================================
 # 📦 PRODUCTS API
 # =====================================================
-@app.route("/api/products")
+# Serialized catalog for the latest catalog version, kept per app in
+# app_state()["catalog_cache"] as {"etag", "body", "encoded"}
+catalog_cache_lock = threading.Lock()
+
+def catalog_etag():
+    # The data version is bumped by every product and stock write
+    return f'"products-{get_storage().data_version()}"'
+
+# Fields a client may pick with ?fields=, mapped to the stored field
+PRODUCT_FIELDS = {
+    "name": "name", "quantity": "quantity", "lowStock": "lowStock",
+    "criticalStock": "criticalStock", "stockLevel": "stockLevel",
+    "category": "category", "supplier": "supplier", "costPrice": "costPrice",
+    "value": "stockValue", "sku": "sku"
+}
+PRODUCT_DEFAULT_FIELDS = ["name", "quantity", "lowStock", "category", "supplier", "costPrice"]
+PRODUCT_PAGE_DEFAULT = 100
+PRODUCT_PAGE_MAX = 500
+# Args that select the query path; anything else (e.g. a cache-buster) is ignored
+PRODUCT_QUERY_ARGS = ("limit", "cursor", "sort", "category", "supplier", "low", "fields", "format")
+
+def product_json(p, fields=None):
+    data = {
+        "id": str(p["_id"]),
+        "name": p.get("name", ""),
+        "quantity": int(p.get("quantity", 0)),
+        "lowStock": int(p.get("lowStock", 0)),
+        "category": p.get("category", ""),
+        "supplier": p.get("supplier", ""),
+        "costPrice": float(p.get("costPrice", 0))
+    }
+    if fields is None:
+        return data
+    data.update(
+        criticalStock=int(p.get("criticalStock", 0)),
+        stockLevel=p.get("stockLevel", "ok"),
+        value=round(float(p.get("stockValue", 0)), 2),
+        sku=p.get("sku")
+    )
+    return {f: data[f] for f in ["id"] + fields}
+
+def build_product_query(args, parse_id):
+    """Translate /api/products args into (spec, fields, error); see Storage.find_products."""
+    sort_arg = args.get("sort", "name")
+    desc = sort_arg.startswith("-")
+    sort_field = PRODUCT_SORT_FIELDS.get(sort_arg.lstrip("-"))
+    if sort_field is None:
+        return None, None, "sort must be name, quantity or value (prefix - for descending)"
+    direction = -1 if desc else 1
+
+    fields = PRODUCT_DEFAULT_FIELDS
+    if args.get("fields"):
+        fields = [f for f in args["fields"].split(",") if f and f != "id"]
+        unknown = [f for f in fields if f not in PRODUCT_FIELDS]
+        if unknown:
+            return None, None, f"Unknown fields: {', '.join(unknown)}"
+
+    spec = {
+        "category": args.get("category"),
+        "supplier": args.get("supplier"),
+        "low": args.get("low") in ("1", "true"),
+        "sort": (sort_field, direction)
+    }
+
+    cursor = args.get("cursor")
+    if cursor:
+        try:
+            last_value, last_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        except Exception:
+            return None, None, "Invalid cursor"
+        last_id = parse_id(last_id)
+        # Only scalars, so a crafted cursor cannot smuggle in an operator document
+        scalar = last_value is None or (
+            isinstance(last_value, (str, int, float)) and not isinstance(last_value, bool)
+        )
+        if last_id is None or not scalar:
+            return None, None, "Invalid cursor"
+        spec["after"] = (last_value, last_id)
+
+    return spec, fields, None
+
+def product_query(spec):
+    """MongoDB filter for a build_product_query() spec."""
+    clauses = []
+    for f in ("category", "supplier"):
+        if spec.get(f):
+            clauses.append({f: spec[f]})
+    if spec.get("low"):
+        clauses.append(LOW_STOCK_QUERY)
+
+    if spec.get("after"):
+        sort_field, direction = spec["sort"]
+        last_value, last_id = spec["after"]
+        op = "$lt" if direction < 0 else "$gt"
+        clauses.append({"$or": [
+            {sort_field: {op: last_value}},
+            {sort_field: last_value, "_id": {op: last_id}}
+        ]})
+
+    return {"$and": clauses} if len(clauses) > 1 else (clauses[0] if clauses else {})
+
+def encode_product_cursor(p, sort_field):
+    raw = json.dumps([p.get(sort_field), str(p["_id"])])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def query_products():
+    """Filtered, sorted, projected and optionally paginated /api/products."""
+    storage = get_storage()
+    spec, fields, error = build_product_query(request.args, storage.parse_id)
+    if error:
+        return jsonify({"error": error}), 400
+
+    limit = None
+    if request.args.get("limit") or request.args.get("cursor"):
+        try:
+            limit = min(max(int(request.args.get("limit", PRODUCT_PAGE_DEFAULT)), 1), PRODUCT_PAGE_MAX)
+        except ValueError:
+            return jsonify({"error": "Invalid limit"}), 400
+
+    # Each distinct query gets its own tag, still bumped by every write
+    args = [(k, v) for k in PRODUCT_QUERY_ARGS for v in request.args.getlist(k)]
+    digest = hashlib.md5(urlencode(args).encode()).hexdigest()[:12]
+    etag = f'"products-{storage.data_version()}-{digest}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if request.if_none_match.contains_weak(etag.strip('"')):
+        return Response(status=304, headers=headers)
+
+    spec["limit"] = limit
+    sort_field = spec["sort"][0]
+    rows = storage.find_products(spec, [PRODUCT_FIELDS[f] for f in fields])
+
+    response = json_response(list_json([product_json(p, fields) for p in rows], ["id"] + fields), headers=headers)
+    # Only hand out a cursor when the page is full
+    if limit and len(rows) == limit:
+        response.headers["X-Next-Cursor"] = encode_product_cursor(rows[-1], sort_field)
+    return response
+
+# Without query params: the whole catalog, cached per version (unchanged
+# contract). With any of limit, cursor, sort, category, supplier, low, fields,
+# format: see query_products(); the next page's cursor is in X-Next-Cursor.
+@bp.route("/api/products")
 def get_products():
     try:
         if not login_required():
             return jsonify({"error": "Unauthorized"}), 403
         
-        result = []
-        for p in products.find():
-            result.append({
-                "id": str(p["_id"]),
-                "name": p.get("name", ""),
-                "quantity": int(p.get("quantity", 0)),
-                "lowStock": int(p.get("lowStock", 0)),
-                "category": p.get("category", ""),
-                "supplier": p.get("supplier", ""),
-                "costPrice": float(p.get("costPrice", 0))
-            })
-        return jsonify(result), 200
+        if any(k in request.args for k in PRODUCT_QUERY_ARGS):
+            return query_products()
+        
+        # Read the version before the data so a cached body is never older than its tag
+        etag = catalog_etag()
+        headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+        
+        if request.if_none_match.contains_weak(etag.strip('"')):
+            return Response(status=304, headers=headers)
+        
+        catalog_cache = app_state()["catalog_cache"]
+        with catalog_cache_lock:
+            body = catalog_cache["body"] if catalog_cache["etag"] == etag else None
+        
+        if body is None:
+            rows = get_storage().list_products([PRODUCT_FIELDS[f] for f in PRODUCT_DEFAULT_FIELDS])
+            body = dump_json([product_json(p) for p in rows])
+            with catalog_cache_lock:
+                catalog_cache.update(etag=etag, body=body, encoded={})
+        
+        # Each version is compressed once per encoding, not once per request
+        encoding = negotiate_encoding() if len(body) >= COMPRESS_MIN_BYTES else None
+        if encoding is None:
+            return json_response(body, headers=headers)
+        with catalog_cache_lock:
+            encoded = catalog_cache["encoded"].get(encoding) if catalog_cache["etag"] == etag else None
+        if encoded is None:
+            encoded = compress_body(body, encoding)
+            with catalog_cache_lock:
+                if catalog_cache["etag"] == etag:
+                    catalog_cache["encoded"][encoding] = encoded
+        response = json_response(encoded, headers=headers)
+        response.vary.add("Accept-Encoding")
+        return mark_encoded(response, encoding)
         
     except Exception as e:
         print(f"❌ Get products error: {str(e)}")
         return jsonify({"error": "Failed to fetch products"}), 500
 
-@app.route("/api/products", methods=["POST"])
+@bp.route("/api/products", methods=["POST"])
 def add_product():
     try:
         if not admin_required():
@@ -284,15 +1060,27 @@ def add_product():
         
         data = request.json
         
-        products.insert_one({
+        low_stock = data.get("lowStock")
+        low_stock = get_alert_settings()["globalThreshold"] if low_stock in (None, "") else int(low_stock)
+        critical_stock = data.get("criticalStock")
+        critical_stock = default_critical_stock(low_stock) if critical_stock in (None, "") else int(critical_stock)
+        
+        product = {
             "name": data.get("name"),
             "category": data.get("category"),
             "supplier": data.get("supplier"),
             "quantity": int(data.get("quantity", 0)),
-            "lowStock": int(data.get("lowStock", 0)),
+            # Stock that came in without a ledger row; see reconcile-stock
+            "openingQuantity": int(data.get("quantity", 0)),
+            "lowStock": low_stock,
+            "criticalStock": min(critical_stock, low_stock),
             "costPrice": float(data.get("costPrice", 0)),
             "createdAt": datetime.utcnow()
-        })
+        }
+        product["stockLevel"] = stock_level(product["quantity"], low_stock, product["criticalStock"])
+        product["stockValue"] = product["quantity"] * product["costPrice"]
+        product["nameKey"] = search_key(product["name"])
+        get_storage().add_product(product)
         
         return jsonify({"message": "Product added successfully"}), 201
         
@@ -300,15 +1088,17 @@ def add_product():
         print(f"❌ Add product error: {str(e)}")
         return jsonify({"error": "Failed to add product"}), 500
 
-@app.route("/api/products/<product_id>", methods=["DELETE"])
+@bp.route("/api/products/<product_id>", methods=["DELETE"])
 def delete_product(product_id):
     try:
         if not admin_required():
             return jsonify({"error": "Unauthorized"}), 403
         
-        result = products.delete_one({"_id": ObjectId(product_id)})
+        storage = get_storage()
+        pid = storage.parse_id(product_id)
+        product = storage.delete_product(pid) if pid is not None else None
         
-        if result.deleted_count == 0:
+        if not product:
             return jsonify({"error": "Product not found"}), 404
         
         return jsonify({"message": "Product deleted successfully"}), 200
@@ -318,39 +1108,147 @@ def delete_product(product_id):
         return jsonify({"error": "Failed to delete product"}), 500
 
 # =====================================================
-# 🔄 TRANSACTIONS
+# 🔎 PRODUCT SEARCH
 # =====================================================
-@app.route("/add_transaction", methods=["POST"])
-def add_transaction():
+# Name prefixes are matched on "nameKey" (lower-cased name) so the anchored
+# regex is an index range scan; words in name, category and supplier go
+# through the "product_search" text index. Prefix hits rank first.
+SEARCH_LIMIT_MAX = 50
+SEARCH_WEIGHTS = {"name": 10, "category": 3, "supplier": 2}
+
+def search_key(name):
+    return " ".join(str(name or "").split()).lower()
+
+@bp.cli.command("backfill-search-keys")
+def backfill_search_keys_command():
+    """Set nameKey on every product (run once after upgrading)."""
+    ops = []
+    for p in products.find({}, {"name": 1}):
+        ops.append(UpdateOne({"_id": p["_id"]}, {"$set": {"nameKey": search_key(p.get("name"))}}))
+    for start in range(0, len(ops), 1000):
+        products.bulk_write(ops[start:start + 1000], ordered=False)
+    print(f"✅ Search keys set on {len(ops)} products")
+
+# Query params: q, limit
+@bp.route("/api/products/search")
+def search_products():
     try:
         if not login_required():
             return jsonify({"error": "Unauthorized"}), 403
 
-        ist = pytz.timezone("Asia/Kolkata")
-        ist_time = datetime.now(ist).replace(tzinfo=None)
+        q = search_key(request.args.get("q"))
+        if not q:
+            return jsonify([]), 200
 
-        product_id = request.form.get("product_id")
-        ttype = request.form.get("transaction_type")
-        qty = int(request.form.get("quantity"))
+        try:
+            limit = min(max(int(request.args.get("limit", 20)), 1), SEARCH_LIMIT_MAX)
+        except ValueError:
+            return jsonify({"error": "Invalid limit"}), 400
 
-        product = products.find_one({"_id": ObjectId(product_id)})
-        if not product:
-            return jsonify({"error": "Product not found"}), 404
+        results = []
+        for p, match, score in get_storage().search_products(q, limit):
+            item = dict(product_json(p), match=match)
+            if score is not None:
+                item["score"] = round(score, 3)
+            results.append(item)
 
-        if ttype == "OUT" and qty > int(product["quantity"]):
-            return jsonify({"error": "Insufficient stock"}), 400
+        return jsonify(results), 200
 
-        new_qty = product["quantity"] + qty if ttype == "IN" else product["quantity"] - qty
-        products.update_one({"_id": ObjectId(product_id)}, {"$set": {"quantity": new_qty}})
+    except Exception as e:
+        print(f"❌ Product search error: {str(e)}")
+        return jsonify({"error": "Failed to search products"}), 500
 
-        transactions.insert_one({
-            "product_id": ObjectId(product_id),
-            "productName": product["name"],
-            "type": ttype,
-            "quantity": qty,
-            "date": ist_time,
-            "user": session.get("email")
-        })
+# =====================================================
+# 🔄 TRANSACTIONS
+# =====================================================
+def ist_now():
+    ist = pytz.timezone("Asia/Kolkata")
+    return datetime.now(ist).replace(tzinfo=None)
+
+def apply_stock_movement(product_id, ttype, qty, user):
+    """
+    Apply one IN/OUT movement with a single conditional $inc and record it in
+    the ledger. Returns (ledger_row, error, status).
+    """
+    if ttype not in ("IN", "OUT"):
+        return None, "transaction_type must be IN or OUT", 400
+    if qty <= 0:
+        return None, "Quantity must be positive", 400
+
+    oid = to_object_id(product_id)
+    if oid is None:
+        return None, "Product not found", 404
+
+    delta = qty if ttype == "IN" else -qty
+    guard = {"_id": oid}
+    if ttype == "OUT":
+        guard["quantity"] = {"$gte": qty}
+
+    product = products.find_one_and_update(
+        guard,
+        stock_update(delta),
+        projection={"name": 1, "quantity": 1, "lowStock": 1, "criticalStock": 1,
+                    "costPrice": 1, "stockLevel": 1, "alertedLevel": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if not product:
+        # Only the failure path pays for a second read to tell the cases apart
+        if products.count_documents({"_id": oid}, limit=1) == 0:
+            return None, "Product not found", 404
+        return None, "Insufficient stock", 400
+
+    row = {
+        "product_id": oid,
+        "productName": product["name"],
+        "type": ttype,
+        "quantity": qty,
+        "date": ist_now(),
+        "user": user
+    }
+    try:
+        transactions.insert_one(row)
+    except Exception:
+        # Keep stock and ledger paired: undo the movement if it was not recorded
+        products.update_one({"_id": oid}, stock_update(-delta))
+        raise
+    record_daily_rollups([row])
+
+    new_qty = int(product["quantity"])
+    threshold = int(product.get("lowStock", 0))
+    was_low = is_low_stock(new_qty - delta, threshold)
+    now_low = is_low_stock(new_qty, threshold)
+    deltas = {
+        "totalValue": delta * float(product.get("costPrice", 0)),
+        "lowStockCount": int(now_low) - int(was_low)
+    }
+    bump_inventory_summary(value=deltas["totalValue"], low=deltas["lowStockCount"])
+    queue_stock_alert(product)
+
+    level_before = stock_level(new_qty - delta, threshold, product.get("criticalStock"))
+    publish_change(
+        stock=[stock_event_item(product, ttype, qty)],
+        stats=deltas,
+        low_stock=[low_stock_event_item(product)] if product["stockLevel"] != level_before else None
+    )
+
+    return row, None, 200
+
+@bp.route("/add_transaction", methods=["POST"])
+def add_transaction():
+    try:
+        if not login_required():
+            return jsonify({"error": "Unauthorized"}), 403
+
+        product_id = request.form.get("product_id")
+        ttype = request.form.get("transaction_type")
+        try:
+            qty = int(request.form.get("quantity"))
+        except (TypeError, ValueError):
+            return jsonify({"error": "Quantity must be a whole number"}), 400
+
+        _, error, status = get_storage().apply_movement(product_id, ttype, qty, session.get("email"))
+        if error:
+            return jsonify({"error": error}), status
 
         return jsonify({"success": True, "message": "Transaction added successfully"}), 200
         
@@ -359,31 +1257,538 @@ def add_transaction():
         traceback.print_exc()
         return jsonify({"error": "Failed to add transaction"}), 500
 
+@bp.cli.command("stress-stock")
+@click.option("--movements", default=5000, help="Number of parallel movements to fire.")
+@click.option("--workers", default=32, help="Concurrent client threads.")
+@click.option("--start-qty", default=1000, help="Opening quantity of the scratch product.")
+@click.option("--database", default=None,
+              help="Scratch database to run in, dropped afterwards "
+                   "(default: <MONGO_DB>_stress, or <SQLITE_PATH>.stress under SQLite).")
+def stress_stock_command(movements, workers, start_qty, database):
+    """Fire parallel IN/OUT movements at one product and check it against the ledger."""
+    # Every movement also writes rollups, summary, events and alerts, so the
+    # run happens in a throwaway database that is dropped afterwards
+    if not uses_mongo():
+        ok = stress_sqlite(database, movements, workers, start_qty)
+        if not ok:
+            raise SystemExit(1)
+        return
+
+    mongo = app_state()["mongo"]
+    live_db = mongo["config"]["MONGO_DB"]
+    database = database or f"{live_db}_stress"
+    if database == live_db:
+        raise click.BadParameter("must not be the configured MONGO_DB", param_hint="--database")
+    mongo["config"]["MONGO_DB"] = database
+    try:
+        get_client().drop_database(database)
+        create_indexes()
+        ok = run_stress_stock(get_storage(), movements, workers, start_qty)
+    finally:
+        get_client().drop_database(database)
+        mongo["config"]["MONGO_DB"] = live_db
+    if not ok:
+        raise SystemExit(1)
+
+def stress_sqlite(path, movements, workers, start_qty):
+    # A scratch file with its own connections: the workers contend for the
+    # same BEGIN IMMEDIATE write lock the live file's writers would
+    live_path = current_app.config["SQLITE_PATH"]
+    path = path or f"{live_path}.stress"
+    if os.path.abspath(path) == os.path.abspath(live_path):
+        raise click.BadParameter("must not be the configured SQLITE_PATH", param_hint="--database")
+    scratch = [path, f"{path}-wal", f"{path}-shm"]
+    for f in scratch:
+        if os.path.exists(f):
+            os.remove(f)
+    try:
+        storage = SqliteStorage(path, ist_now)
+        storage.create_schema()
+        return run_stress_stock(storage, movements, workers, start_qty)
+    finally:
+        for f in scratch:
+            if os.path.exists(f):
+                os.remove(f)
+
+def run_stress_stock(storage, movements, workers, start_qty):
+    user = "stress-test@smartstock"
+    product = {
+        "name": f"Stress Test {datetime.utcnow().isoformat()}",
+        "category": "Test",
+        "supplier": "Test",
+        "quantity": start_qty,
+        "openingQuantity": start_qty,
+        "lowStock": 0,
+        "criticalStock": 0,
+        "stockLevel": "ok",
+        "costPrice": 0.0,
+        "createdAt": datetime.utcnow()
+    }
+    product_id = storage.add_product(product)
+
+    # Mostly OUT so the insufficient-stock guard is exercised as well
+    plan = [("OUT", 3) if i % 3 else ("IN", 2) for i in range(movements)]
+    app = current_app._get_current_object()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(
+            lambda m: run_with_app_context(app, storage.apply_movement, product_id, m[0], m[1], user), plan
+        ))
+
+    rejected = sum(1 for _, error, _ in results if error)
+    ledger_in = ledger_out = ledger_rows = 0
+    for t in storage.iter_transactions({"product_id": product_id, "user": user}):
+        if t["type"] == "IN":
+            ledger_in += t["quantity"]
+        else:
+            ledger_out += t["quantity"]
+        ledger_rows += 1
+
+    final_qty = next(p["quantity"] for p in storage.list_products(["quantity"]) if p["_id"] == product_id)
+    expected = start_qty + ledger_in - ledger_out
+
+    print(f"Movements: {movements}, applied: {ledger_rows}, rejected: {rejected}")
+    print(f"Final quantity: {final_qty}, expected from ledger: {expected}")
+    if final_qty != expected or final_qty < 0 or ledger_rows + rejected != movements:
+        print("❌ Stock and ledger disagree")
+        return False
+    print("✅ Stock matches ledger")
+    return True
+
+# =====================================================
+# 📥 BULK TRANSACTIONS
+# =====================================================
+BULK_MAX_MOVEMENTS = 5000
+
+# Number of recent batches remembered on each product ({id, before}), used to
+# tell which per-product update of a bulk_write did not match its stock guard
+# and what quantity that update started from
+RECENT_BATCHES_KEPT = 20
+
+def apply_stock_movements(movements, user):
+    """
+    Apply a batch of IN/OUT movements with a constant number of round trips:
+    one product read, one bulk_write, one read-back, one insert_many, one
+    summary update and one batched alert queue. Returns a per-item result list
+    in input order.
+    """
+    results = [None] * len(movements)
+    parsed = []
+
+    for i, m in enumerate(movements):
+        if not isinstance(m, dict):
+            results[i] = {"index": i, "success": False, "error": "Movement must be an object"}
+            continue
+        ttype = m.get("transaction_type", m.get("type"))
+        oid = to_object_id(m.get("product_id"))
+        try:
+            qty = int(m.get("quantity"))
+        except (TypeError, ValueError):
+            qty = 0
+        if ttype not in ("IN", "OUT"):
+            results[i] = {"index": i, "success": False, "error": "transaction_type must be IN or OUT"}
+        elif qty <= 0:
+            results[i] = {"index": i, "success": False, "error": "Quantity must be positive"}
+        elif oid is None:
+            results[i] = {"index": i, "success": False, "error": "Product not found"}
+        else:
+            parsed.append((i, oid, ttype, qty))
+
+    current = {
+        p["_id"]: p
+        for p in products.find(
+            {"_id": {"$in": list({oid for _, oid, _, _ in parsed})}},
+            {"name": 1, "quantity": 1, "lowStock": 1, "criticalStock": 1,
+             "costPrice": 1, "alertedLevel": 1}
+        )
+    } if parsed else {}
+
+    # Replay each product's movements in order against the stock we just read
+    plans = {}
+    for i, oid, ttype, qty in parsed:
+        product = current.get(oid)
+        if not product:
+            results[i] = {"index": i, "success": False, "error": "Product not found"}
+            continue
+        plan = plans.setdefault(oid, {"running": int(product.get("quantity", 0)),
+                                      "net": 0, "required": 0, "items": []})
+        delta = qty if ttype == "IN" else -qty
+        if plan["running"] + delta < 0:
+            results[i] = {"index": i, "success": False, "error": "Insufficient stock"}
+            continue
+        plan["running"] += delta
+        plan["net"] += delta
+        plan["required"] = max(plan["required"], -plan["net"])
+        plan["items"].append((i, ttype, qty))
+
+    if plans:
+        batch_id = ObjectId()
+        ops = [
+            UpdateOne(
+                {"_id": oid, "quantity": {"$gte": plan["required"]}},
+                # Record the quantity this update started from before moving it
+                [{"$set": {"recentBatches": {"$slice": [
+                    {"$concatArrays": [
+                        {"$ifNull": ["$recentBatches", []]},
+                        [{"id": batch_id, "before": "$quantity"}]
+                    ]},
+                    -RECENT_BATCHES_KEPT
+                ]}}}] + stock_update(plan["net"])
+            )
+            for oid, plan in plans.items()
+        ]
+        products.bulk_write(ops, ordered=False)
+
+        # Products whose update matched, with the quantity it was applied to;
+        # the rest had stock moved underneath them
+        started = {
+            p["_id"]: int(p["recentBatches"][0]["before"])
+            for p in products.find(
+                {"_id": {"$in": list(plans)}, "recentBatches.id": batch_id},
+                {"recentBatches": {"$elemMatch": {"id": batch_id}}}
+            )
+        }
+        for oid in [oid for oid in plans if oid not in started]:
+            for i, _, _ in plans.pop(oid)["items"]:
+                results[i] = {"index": i, "success": False,
+                              "error": "Stock changed concurrently, please retry"}
+
+    if plans:
+        now = ist_now()
+        rows = [
+            {
+                "_id": ObjectId(),
+                "product_id": oid,
+                "productName": current[oid]["name"],
+                "type": ttype,
+                "quantity": qty,
+                "date": now,
+                "user": user
+            }
+            for oid, plan in plans.items()
+            for _, ttype, qty in plan["items"]
+        ]
+        try:
+            transactions.insert_many(rows, ordered=True)
+        except Exception:
+            # Some rows may have landed before the failure: remove them by
+            # their pre-assigned ids so every product's whole net can be undone
+            transactions.delete_many({"_id": {"$in": [r["_id"] for r in rows]}})
+            products.bulk_write([
+                UpdateOne({"_id": oid}, stock_update(-plan["net"]))
+                for oid, plan in plans.items()
+            ], ordered=False)
+            raise
+        record_daily_rollups(rows)
+
+        # Deltas come from the quantity each update actually started from, so
+        # concurrent writers to the same product cannot skew the summary
+        value = 0.0
+        low = 0
+        stock_items = []
+        low_items = []
+        moved_products = []
+        for oid, plan in plans.items():
+            product = current[oid]
+            threshold = int(product.get("lowStock", 0))
+            before = started[oid]
+            after = before + plan["net"]
+            value += plan["net"] * float(product.get("costPrice", 0))
+            low += int(is_low_stock(after, threshold)) - int(is_low_stock(before, threshold))
+            moved = dict(product, quantity=after, stockLevel=stock_level(
+                after, threshold, product.get("criticalStock")
+            ))
+            moved_products.append(moved)
+            stock_items.append(stock_event_item(moved))
+            if moved["stockLevel"] != stock_level(before, threshold, product.get("criticalStock")):
+                low_items.append(low_stock_event_item(moved))
+        bump_inventory_summary(value=value, low=low)
+        queue_stock_alerts(moved_products)
+
+        publish_change(
+            stock=stock_items,
+            stats={"totalValue": value, "lowStockCount": low},
+            low_stock=low_items or None
+        )
+
+        for plan in plans.values():
+            for i, _, _ in plan["items"]:
+                results[i] = {"index": i, "success": True}
+
+    return results
+
+@bp.route("/api/transactions/bulk", methods=["POST"])
+def bulk_add_transactions():
+    claim_id = None
+    try:
+        if not login_required():
+            return jsonify({"error": "Unauthorized"}), 403
+
+        data = request.json
+
+        if not data or not isinstance(data.get("movements"), list):
+            return jsonify({"error": "movements list is required"}), 400
+
+        movements = data["movements"]
+        if len(movements) > BULK_MAX_MOVEMENTS:
+            return jsonify({"error": f"At most {BULK_MAX_MOVEMENTS} movements per batch"}), 400
+
+        user = session.get("email")
+        key = request.headers.get("Idempotency-Key") or data.get("idempotencyKey")
+
+        if key:
+            claim_id = f"{user}:{key}"
+            try:
+                bulk_requests.insert_one({"_id": claim_id, "createdAt": datetime.utcnow()})
+            except DuplicateKeyError:
+                claim_id = None
+                previous = bulk_requests.find_one({"_id": f"{user}:{key}"})
+                if previous and "response" in previous:
+                    return jsonify(previous["response"]), 200
+                return jsonify({"error": "Batch with this idempotency key is still in progress"}), 409
+
+        results = apply_stock_movements(movements, user)
+        applied = sum(1 for r in results if r["success"])
+        body = {"applied": applied, "failed": len(results) - applied, "results": results}
+
+        if claim_id:
+            bulk_requests.update_one({"_id": claim_id}, {"$set": {"response": body}})
+
+        return jsonify(body), 200
+
+    except Exception as e:
+        if claim_id:
+            # Release the key so the client can retry the batch
+            bulk_requests.delete_one({"_id": claim_id, "response": {"$exists": False}})
+        print(f"❌ Bulk transaction error: {str(e)}")
+        traceback.print_exc()
+        return jsonify({"error": "Failed to apply transactions"}), 500
+
+# =====================================================
+# 📜 TRANSACTION QUERY HELPERS
+# =====================================================
+TRANSACTION_PAGE_MAX = 500
+
+def encode_cursor(date, oid):
+    raw = f"{date.isoformat()}|{oid}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor, parse_id):
+    raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+    date, oid = raw.split("|", 1)
+    last_id = parse_id(oid)
+    if last_id is None:
+        raise ValueError("Invalid cursor id")
+    return datetime.fromisoformat(date), last_id
+
+def parse_date_arg(value, end=False):
+    # Accepts YYYY-MM-DD or a full ISO timestamp (IST, naive like the ledger)
+    parsed = datetime.fromisoformat(value)
+    if end and len(value) == 10:
+        parsed += timedelta(days=1)
+    return parsed
+
+def parse_transaction_filters(args, parse_id):
+    """
+    Validate history filters into a spec: product_id, type, user, from, to
+    (exclusive) and before = (date, id) for keyset pages. Returns (spec, error).
+    """
+    spec = {}
+
+    product_id = args.get("product_id")
+    if product_id:
+        spec["product_id"] = parse_id(product_id)
+        if spec["product_id"] is None:
+            return None, "Invalid product_id"
+
+    ttype = args.get("type")
+    if ttype:
+        if ttype not in ("IN", "OUT"):
+            return None, "type must be IN or OUT"
+        spec["type"] = ttype
+
+    if args.get("user"):
+        spec["user"] = args["user"]
+
+    try:
+        if args.get("from"):
+            spec["from"] = parse_date_arg(args["from"])
+        if args.get("to"):
+            spec["to"] = parse_date_arg(args["to"], end=True)
+    except ValueError:
+        return None, "Invalid date range"
+
+    cursor = args.get("cursor")
+    if cursor:
+        try:
+            spec["before"] = decode_cursor(cursor, parse_id)
+        except Exception:
+            return None, "Invalid cursor"
+
+    return spec, None
+
+def transaction_query(spec):
+    """MongoDB filter for a parse_transaction_filters() spec."""
+    clauses = [{f: spec[f]} for f in ("product_id", "type", "user") if f in spec]
+
+    date_range = {}
+    if "from" in spec:
+        date_range["$gte"] = spec["from"]
+    if "to" in spec:
+        date_range["$lt"] = spec["to"]
+    if date_range:
+        clauses.append({"date": date_range})
+
+    if "before" in spec:
+        last_date, last_id = spec["before"]
+        clauses.append({"$or": [
+            {"date": {"$lt": last_date}},
+            {"date": last_date, "_id": {"$lt": last_id}}
+        ]})
+
+    if not clauses:
+        return {}
+    if len(clauses) == 1:
+        return clauses[0]
+    return {"$and": clauses}
+
+def build_transaction_query(args):
+    """Translate request args into a Mongo filter. Returns (query, error)."""
+    spec, error = parse_transaction_filters(args, to_object_id)
+    if error:
+        return None, error
+    return transaction_query(spec), None
+
+# =====================================================
+# 🗄️ LEDGER ARCHIVE (hot / cold tiering)
+# =====================================================
+# `flask archive-transactions` moves ledger rows older than the retention
+# window into "transactions_archive", keeping the hot collection (and its many
+# filter indexes) small. Each archived (product, month) leaves an
+# opening-balance record in "opening_balances", so a product's position at the
+# archive boundary is the sum of its records without reading the cold rows.
+# History queries and exports whose range reaches before the boundary (no
+# "from", or a "from" before it) read the archive as well. While a run copies
+# a batch and before it deletes it, those rows exist in both collections, so
+# readers merge the two in (date, _id) order and drop the second copy.
+ARCHIVE_ID = "archive"
+
+def archive_boundary():
+    # Every ledger row dated before this lives in transactions_archive
+    state = stats.find_one({"_id": ARCHIVE_ID}, {"archivedBefore": 1}) or {}
+    return state.get("archivedBefore")
+
+def reaches_archive(start):
+    """The archive boundary if a range starting at start (None = unbounded) reaches it, else None."""
+    boundary = archive_boundary()
+    if boundary is None or (start is not None and start >= boundary):
+        return None
+    return boundary
+
+def month_start(value, months_back=0):
+    year, month = value.year, value.month - months_back
+    while month < 1:
+        month += 12
+        year -= 1
+    return datetime(year, month, 1)
+
+def record_opening_balances(start, end):
+    """Rebuild the per-product monthly opening-balance records for archived months in [start, end)."""
+    transactions_archive.aggregate([
+        {"$match": {"date": {"$gte": start, "$lt": end}, "product_id": {"$exists": True}}},
+        {"$group": {
+            "_id": {"product_id": "$product_id",
+                    "month": {"$dateTrunc": {"date": "$date", "unit": "month"}}},
+            "productName": {"$last": "$productName"},
+            "inCount": {"$sum": {"$cond": [{"$eq": ["$type", "IN"]}, 1, 0]}},
+            "outCount": {"$sum": {"$cond": [{"$eq": ["$type", "OUT"]}, 1, 0]}},
+            "inQty": {"$sum": {"$cond": [{"$eq": ["$type", "IN"]}, "$quantity", 0]}},
+            "outQty": {"$sum": {"$cond": [{"$eq": ["$type", "OUT"]}, "$quantity", 0]}}
+        }},
+        {"$project": dict({"_id": 0, "product_id": "$_id.product_id", "month": "$_id.month",
+                           "productName": 1, "net": {"$subtract": ["$inQty", "$outQty"]}},
+                          **{f: 1 for f in ROLLUP_FIELDS})},
+        {"$merge": {"into": "opening_balances", "on": ["product_id", "month"],
+                    "whenMatched": "replace", "whenNotMatched": "insert"}}
+    ], allowDiskUse=True)
+
+@bp.cli.command("archive-transactions")
+@click.option("--months", type=int, default=None,
+              help="Months of history to keep hot (default: ARCHIVE_RETENTION_MONTHS).")
+@click.option("--batch-size", type=int, default=5000, show_default=True)
+def archive_transactions_command(months, batch_size):
+    """Move ledger rows older than the retention window to the archive (resumable)."""
+    months = months if months is not None else current_app.config["ARCHIVE_RETENTION_MONTHS"]
+    if months < 1:
+        raise click.BadParameter("must be at least 1", param_hint="--months")
+    cutoff = month_start(ist_now(), months)
+
+    # Publish the new boundary first so readers already look in the archive
+    # while rows move. A row is copied before it is deleted, and duplicate
+    # copies left by an interrupted run are skipped on the next one.
+    state = stats.find_one_and_update(
+        {"_id": ARCHIVE_ID},
+        {"$max": {"archivedBefore": cutoff}},
+        upsert=True, return_document=ReturnDocument.AFTER
+    )
+    cutoff = state["archivedBefore"]
+
+    moved = 0
+    while True:
+        batch = list(
+            transactions.find({"date": {"$lt": cutoff}})
+            .sort([("date", 1), ("_id", 1)])
+            .limit(batch_size)
+        )
+        if not batch:
+            break
+        if moved == 0:
+            # Months touched by this run; cleared once their balances are written
+            stats.update_one({"_id": ARCHIVE_ID}, {"$min": {"balancesFrom": month_start(batch[0]["date"])}})
+        try:
+            transactions_archive.insert_many(batch, ordered=False)
+        except BulkWriteError as e:
+            if any(err["code"] != 11000 for err in e.details["writeErrors"]):
+                raise
+        transactions.delete_many({"_id": {"$in": [r["_id"] for r in batch]}})
+        moved += len(batch)
+        print(f"   … {moved} rows archived")
+
+    pending = stats.find_one({"_id": ARCHIVE_ID}).get("balancesFrom")
+    if pending is not None:
+        record_opening_balances(pending, cutoff)
+        stats.update_one({"_id": ARCHIVE_ID}, {"$unset": {"balancesFrom": ""}})
+
+    print(f"✅ Archived {moved} ledger rows dated before {cutoff:%Y-%m-%d}")
+
 # =====================================================
 # 📜 TRANSACTION HISTORY (FIXED – FINAL)
 # =====================================================
-@app.route("/api/transactions")
+TRANSACTION_JSON_FIELDS = ["productName", "type", "quantity", "date", "user"]
+
+# Query params: product_id, type, user, from, to, limit, cursor, format.
+# The next page's cursor is returned in the X-Next-Cursor header.
+@bp.route("/api/transactions")
 def get_transactions():
     try:
         if not login_required():
             return jsonify({"error": "Unauthorized"}), 403
 
-        data = []
+        storage = get_storage()
+        spec, error = parse_transaction_filters(request.args, storage.parse_id)
+        if error:
+            return jsonify({"error": error}), 400
 
-        for t in transactions.find().sort("_id", -1).limit(100):
+        try:
+            limit = min(max(int(request.args.get("limit", 100)), 1), TRANSACTION_PAGE_MAX)
+        except ValueError:
+            return jsonify({"error": "Invalid limit"}), 400
 
-            # Resolve product name safely
-            product_name = "Unknown Product"
+        data = []
+        # Product names come back resolved to the current name
+        rows = storage.find_transactions(spec, limit)
 
-            if "product_id" in t:
-                try:
-                    product = products.find_one({"_id": ObjectId(t["product_id"])})
-                    if product:
-                        product_name = product.get("name", "Unknown Product")
-                except:
-                    pass
-            else:
-                product_name = t.get("productName", "Unknown Product")
+        for t in rows:
+            product_name = t.get("productName", "Unknown Product")
 
             # Ensure date is JSON-safe (ISO format for JS)
             tx_date = t.get("date")
@@ -400,7 +1805,11 @@ def get_transactions():
                 "user": t.get("user", "N/A")
             })
 
-        return jsonify(data), 200
+        response = json_response(list_json(data, TRANSACTION_JSON_FIELDS))
+        # Only hand out a cursor when the page is full
+        if len(rows) == limit and isinstance(rows[-1].get("date"), datetime):
+            response.headers["X-Next-Cursor"] = encode_cursor(rows[-1]["date"], rows[-1]["_id"])
+        return response, 200
 
     except Exception as e:
         print("❌ Get transactions error:", e)
@@ -408,31 +1817,1158 @@ def get_transactions():
         return jsonify({"error": "Failed to fetch transactions"}), 500
 
 
+# =====================================================
+# 📅 DAILY ROLLUPS (per IST day, per product)
+# =====================================================
+# One document per (day, product_id) with IN/OUT counts and quantities, plus
+# an all-products row per day with product_id None. Ledger dates are naive
+# IST, so "day" is the IST calendar day at midnight.
+SUMMARY_PERIODS = {"daily": 30, "weekly": 12 * 7, "monthly": 365}
+ROLLUP_FIELDS = ("inCount", "outCount", "inQty", "outQty")
+# _id of the "stats" document whose version counts full rollup rebuilds
+ROLLUPS_ID = "rollups"
+
+def rollups_version():
+    # Live movements already bump the summary version; this covers backfills
+    return (stats.find_one({"_id": ROLLUPS_ID}) or {}).get("version", 0)
+
+def ist_day(value):
+    return value.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def record_daily_rollups(rows):
+    """Upsert the day/product rollups for freshly inserted ledger rows in one bulk_write."""
+    totals = {}
+    for r in rows:
+        prefix = "in" if r["type"] == "IN" else "out"
+        day = ist_day(r["date"])
+        for pid in (r["product_id"], None):
+            t = totals.setdefault((day, pid), {
+                "inc": dict.fromkeys(ROLLUP_FIELDS, 0),
+                "name": r["productName"] if pid else None
+            })
+            t["inc"][f"{prefix}Count"] += 1
+            t["inc"][f"{prefix}Qty"] += r["quantity"]
+
+    ops = []
+    for (day, pid), t in totals.items():
+        update = {"$inc": t["inc"]}
+        if pid is not None:
+            update["$set"] = {"productName": t["name"]}
+        ops.append(UpdateOne({"day": day, "product_id": pid}, update, upsert=True))
+
+    # Derived data: a failure is logged and repaired by `flask backfill-rollups`
+    try:
+        daily_rollups.bulk_write(ops, ordered=False)
+    except Exception as e:
+        print(f"❌ Rollup update error: {str(e)}")
+
+def rollup_day_range(args, default_days=30):
+    """Parse from/to (YYYY-MM-DD, inclusive) into a day filter. Returns (filter, error)."""
+    try:
+        end = ist_day(datetime.fromisoformat(args["to"])) if args.get("to") else ist_day(ist_now())
+        start = ist_day(datetime.fromisoformat(args["from"])) if args.get("from") else end - timedelta(days=default_days - 1)
+    except ValueError:
+        return None, "Invalid date range"
+    if start > end:
+        return None, "from must not be after to"
+    return {"$gte": start, "$lte": end}, None
+
+def period_start(day, period):
+    if period == "weekly":
+        return day - timedelta(days=day.weekday())
+    if period == "monthly":
+        return day.replace(day=1)
+    return day
+
+@bp.cli.command("backfill-rollups")
+def backfill_rollups_command():
+    """Rebuild daily rollups from the whole ledger, archive included (idempotent)."""
+    day = {"$dateTrunc": {"date": "$date", "unit": "day"}}
+    sums = {
+        "inCount": {"$sum": {"$cond": [{"$eq": ["$type", "IN"]}, 1, 0]}},
+        "outCount": {"$sum": {"$cond": [{"$eq": ["$type", "OUT"]}, 1, 0]}},
+        "inQty": {"$sum": {"$cond": [{"$eq": ["$type", "IN"]}, "$quantity", 0]}},
+        "outQty": {"$sum": {"$cond": [{"$eq": ["$type", "OUT"]}, "$quantity", 0]}}
+    }
+    merge = {"$merge": {"into": "daily_rollups", "on": ["day", "product_id"],
+                        "whenMatched": "replace", "whenNotMatched": "insert"}}
+    project = {"_id": 0, "day": "$_id.day", "product_id": "$_id.product_id"}
+    project.update({f: 1 for f in ROLLUP_FIELDS})
+
+    transactions.aggregate([
+        {"$unionWith": "transactions_archive"},
+        {"$match": {"product_id": {"$exists": True}}},
+        {"$group": dict({"_id": {"day": day, "product_id": "$product_id"},
+                         "productName": {"$last": "$productName"}}, **sums)},
+        {"$project": dict(project, productName=1)},
+        merge
+    ], allowDiskUse=True)
+
+    # All-products rows are summed from the per-product rows just written
+    daily_rollups.aggregate([
+        {"$match": {"product_id": {"$ne": None}}},
+        {"$group": dict({"_id": {"day": "$day", "product_id": None}},
+                        **{f: {"$sum": f"${f}"} for f in ROLLUP_FIELDS})},
+        {"$project": project},
+        merge
+    ], allowDiskUse=True)
+    stats.update_one({"_id": ROLLUPS_ID}, {"$inc": {"version": 1}}, upsert=True)
+
+    print(f"✅ Daily rollups rebuilt: {daily_rollups.count_documents({'product_id': None})} days")
+
+# Query params: period (daily|weekly|monthly), from, to, product_id
+@bp.route("/api/summary")
+def movement_summary():
+    try:
+        if not login_required():
+            return jsonify({"error": "Unauthorized"}), 403
+
+        period = request.args.get("period", "daily")
+        if period not in SUMMARY_PERIODS:
+            return jsonify({"error": "period must be daily, weekly or monthly"}), 400
+
+        day_range, error = rollup_day_range(request.args, SUMMARY_PERIODS[period])
+        if error:
+            return jsonify({"error": error}), 400
+
+        product_id = None
+        if request.args.get("product_id"):
+            product_id = to_object_id(request.args["product_id"])
+            if product_id is None:
+                return jsonify({"error": "Invalid product_id"}), 400
+
+        buckets = {}
+        for r in daily_rollups.find({"product_id": product_id, "day": day_range}).sort("day", 1):
+            key = period_start(r["day"], period)
+            b = buckets.setdefault(key, dict.fromkeys(ROLLUP_FIELDS, 0))
+            for f in ROLLUP_FIELDS:
+                b[f] += int(r.get(f, 0))
+
+        return jsonify([
+            dict(b, period=key.strftime("%Y-%m-%d"), itemsMoved=b["inQty"] + b["outQty"])
+            for key, b in buckets.items()
+        ]), 200
+
+    except Exception as e:
+        print(f"❌ Summary error: {str(e)}")
+        return jsonify({"error": "Failed to fetch summary"}), 500
+
+# =====================================================
+# 📸 INVENTORY SNAPSHOTS (point-in-time valuation)
+# =====================================================
+# `flask snapshot-inventory` stores every product's quantity as of an IST
+# midnight (schedule it daily, e.g. cron `5 0 * * * flask snapshot-inventory`).
+# Each snapshot is the previous one plus the ledger movements in between, so
+# it never depends on when products happened to be read. Products with no
+# earlier snapshot (new, or the very first run) are derived from their current
+# quantity minus the movements since. /api/inventory/as-of then replays only
+# the movements between the nearest snapshot and the requested time.
+AS_OF_CSV_HEADER = ["Name", "Category", "Supplier", "Qty", "Cost", "Total Value"]
+SNAPSHOT_BATCH_SIZE = 1000
+
+def ist_to_utc(value):
+    # products.createdAt is naive UTC while ledger times are naive IST
+    ist = pytz.timezone("Asia/Kolkata")
+    return ist.localize(value).astimezone(pytz.utc).replace(tzinfo=None)
+
+def ledger_net(start=None, end=None, product_ids=None):
+    """Net IN - OUT quantity per product over ledger rows with start <= date < end."""
+    match = {"product_id": {"$exists": True}}
+    if product_ids is not None:
+        match["product_id"] = {"$in": list(product_ids)}
+    date_range = {}
+    if start is not None:
+        date_range["$gte"] = start
+    if end is not None:
+        date_range["$lt"] = end
+    if date_range:
+        match["date"] = date_range
+
+    pipeline = [{"$match": match}]
+    boundary = archive_boundary()
+    if boundary is not None and (start is None or start < boundary):
+        pipeline.append({"$unionWith": {"coll": "transactions_archive", "pipeline": [{"$match": match}]}})
+    pipeline.append({"$group": {"_id": "$product_id", "net": {"$sum": {
+        "$cond": [{"$eq": ["$type", "IN"]}, "$quantity", {"$multiply": ["$quantity", -1]}]
+    }}}})
+    return {r["_id"]: r["net"] for r in transactions.aggregate(pipeline, allowDiskUse=True)}
+
+def latest_snapshot(before):
+    # Only completed runs count; an interrupted one is simply redone
+    run = snapshot_runs.find_one(
+        {"_id": {"$lte": before}, "completedAt": {"$exists": True}},
+        sort=[("_id", -1)]
+    )
+    return run["_id"] if run else None
+
+def products_created(start, end, product_id=None):
+    """Products created in [start, end) of IST time; start None means since forever."""
+    created = {"$lt": ist_to_utc(end)}
+    if start is not None:
+        created["$gte"] = ist_to_utc(start)
+    query = {"createdAt": created}
+    if start is None:
+        # Products from before createdAt was recorded count as old
+        query = {"$or": [query, {"createdAt": {"$exists": False}}]}
+    if product_id is not None:
+        query = {"$and": [query, {"_id": product_id}]}
+    return products.find(query, {"name": 1, "category": 1, "supplier": 1, "costPrice": 1, "quantity": 1})
+
+def take_inventory_snapshot(at):
+    prev = latest_snapshot(at - timedelta(microseconds=1))
+    base = {}
+    moved = {}
+    if prev is not None:
+        base = {s["product_id"]: s["quantity"]
+                for s in inventory_snapshots.find({"at": prev}, {"product_id": 1, "quantity": 1})}
+        moved = ledger_net(prev, at)
+
+    current = list(products_created(None, at))
+    fresh = [p["_id"] for p in current if p["_id"] not in base]
+    since = ledger_net(at, None, fresh) if fresh else {}
+
+    ops = []
+    count = 0
+    for p in current:
+        pid = p["_id"]
+        if pid in base:
+            qty = base[pid] + moved.get(pid, 0)
+        else:
+            qty = int(p.get("quantity", 0)) - since.get(pid, 0)
+        ops.append(UpdateOne({"at": at, "product_id": pid}, {"$set": {
+            "productName": p.get("name", ""),
+            "category": p.get("category", ""),
+            "supplier": p.get("supplier", ""),
+            "costPrice": float(p.get("costPrice", 0)),
+            "quantity": qty
+        }}, upsert=True))
+        if len(ops) >= SNAPSHOT_BATCH_SIZE:
+            inventory_snapshots.bulk_write(ops, ordered=False)
+            count += len(ops)
+            ops = []
+    if ops:
+        inventory_snapshots.bulk_write(ops, ordered=False)
+        count += len(ops)
+
+    snapshot_runs.update_one({"_id": at}, {"$set": {"products": count, "completedAt": ist_now()}}, upsert=True)
+    return count
+
+@bp.cli.command("snapshot-inventory")
+@click.option("--date", "day", default=None, help="IST day to snapshot at midnight (default: today).")
+def snapshot_inventory_command(day):
+    """Store per-product quantities as of an IST midnight (idempotent)."""
+    at = ist_day(datetime.fromisoformat(day)) if day else ist_day(ist_now())
+    if at > ist_now():
+        raise click.BadParameter("must not be in the future", param_hint="--date")
+    count = take_inventory_snapshot(at)
+    print(f"✅ Snapshot of {count} products as of {at:%Y-%m-%d %H:%M} IST")
+
+def inventory_as_of(at, snap, product_id=None):
+    """Yield one product dict per product as of `at`, replaying from snapshot `snap`, in name order."""
+    only = [product_id] if product_id is not None else None
+
+    # Products created after the snapshot are not in it: derive them backwards
+    fresh = list(products_created(snap, at, product_id))
+    since = ledger_net(at, None, [p["_id"] for p in fresh]) if fresh else {}
+    derived = sorted((
+        {"name": p.get("name", ""), "category": p.get("category", ""), "supplier": p.get("supplier", ""),
+         "costPrice": float(p.get("costPrice", 0)),
+         "quantity": int(p.get("quantity", 0)) - since.get(p["_id"], 0)}
+        for p in fresh
+    ), key=lambda r: r["name"])
+
+    if snap is None:
+        yield from derived
+        return
+
+    moved = ledger_net(snap, at, only)
+    query = {"at": snap}
+    if product_id is not None:
+        query["product_id"] = product_id
+    cursor = inventory_snapshots.find(query).sort("productName", 1).batch_size(EXPORT_BATCH_SIZE)
+    replayed = (
+        {"name": s.get("productName", ""), "category": s.get("category", ""), "supplier": s.get("supplier", ""),
+         "costPrice": float(s.get("costPrice", 0)),
+         "quantity": int(s.get("quantity", 0)) + moved.get(s["product_id"], 0)}
+        for s in cursor
+    )
+    yield from heapq.merge(replayed, derived, key=lambda r: r["name"])
+
+# Query params: date (YYYY-MM-DD = end of that day, or ISO time), product_id, format (json|csv)
+@bp.route("/api/inventory/as-of")
+def inventory_as_of_route():
+    try:
+        if not admin_required():
+            return jsonify({"error": "Unauthorized"}), 403
+
+        if not request.args.get("date"):
+            return jsonify({"error": "date is required"}), 400
+        try:
+            at = parse_date_arg(request.args["date"], end=True)
+        except ValueError:
+            return jsonify({"error": "Invalid date"}), 400
+        if at > ist_now():
+            at = ist_now()
+
+        product_id = None
+        if request.args.get("product_id"):
+            product_id = to_object_id(request.args["product_id"])
+            if product_id is None:
+                return jsonify({"error": "Invalid product_id"}), 400
+
+        snap = latest_snapshot(at)
+        rows = inventory_as_of(at, snap, product_id)
+
+        if request.args.get("format") == "csv":
+            lines = ([r["name"], r["category"], r["supplier"], r["quantity"], r["costPrice"],
+                      round(r["quantity"] * r["costPrice"], 2)] for r in rows)
+            return csv_response(stream_csv(AS_OF_CSV_HEADER, lines), f"inventory-as-of-{at:%Y-%m-%d}.csv")
+
+        items = []
+        total_value = 0
+        for r in rows:
+            r["value"] = round(r["quantity"] * r["costPrice"], 2)
+            total_value += r["value"]
+            items.append(r)
+        return jsonify({
+            "asOf": at.isoformat(),
+            "snapshot": snap.isoformat() if snap else None,
+            "totalQuantity": sum(r["quantity"] for r in items),
+            "totalValue": round(total_value, 2),
+            "products": items
+        }), 200
+
+    except Exception as e:
+        print(f"❌ As-of inventory error: {str(e)}")
+        return jsonify({"error": "Failed to compute inventory"}), 500
+
+# =====================================================
+# 🧾 STOCK RECONCILIATION (ledger vs. quantity)
+# =====================================================
+# A product's quantity should equal its openingQuantity plus every IN minus
+# every OUT in the ledger (archived months through opening_balances).
+# `flask reconcile-stock` checks this for id-range partitions of the catalog
+# in parallel, one server-side aggregation per partition. Partitions and
+# their results are stored on the run, so an interrupted run can be resumed.
+# Ledger rows whose product no longer exists are reported as orphans.
+RECONCILE_SAMPLE = 20
+
+def reconcile_partitions(count):
+    """Split the product id space into about `count` contiguous ranges of similar size."""
+    step = max(products.estimated_document_count() // count, 1)
+    bounds = [None]
+    for i, p in enumerate(products.find({}, {"_id": 1}).sort("_id", 1)):
+        if i and i % step == 0:
+            bounds.append(p["_id"])
+    bounds.append(None)
+    return [{"lo": lo, "hi": hi} for lo, hi in zip(bounds, bounds[1:])]
+
+def id_range(part, field):
+    bounds = {}
+    if part["lo"] is not None:
+        bounds["$gte"] = part["lo"]
+    if part["hi"] is not None:
+        bounds["$lt"] = part["hi"]
+    return {field: bounds or {"$exists": True}}
+
+def product_ledger_net(product_id):
+    # Same sources as the partition pass: the hot ledger plus opening balances,
+    # which already sum the archived rows (so no archive union here)
+    hot = transactions.aggregate([
+        {"$match": {"product_id": product_id}},
+        {"$group": {"_id": None, "net": {"$sum": {
+            "$cond": [{"$eq": ["$type", "IN"]}, "$quantity", {"$multiply": ["$quantity", -1]}]
+        }}}}
+    ])
+    net = sum(h["net"] for h in hot)
+    balances = opening_balances.aggregate([
+        {"$match": {"product_id": product_id}},
+        {"$group": {"_id": None, "net": {"$sum": "$net"}}}
+    ])
+    return net + sum(b["net"] for b in balances)
+
+def reconcile_partition(run_id, index, part, repair):
+    hot = {r["_id"]: r for r in transactions.aggregate([
+        {"$match": id_range(part, "product_id")},
+        {"$group": {"_id": "$product_id", "rows": {"$sum": 1}, "net": {"$sum": {
+            "$cond": [{"$eq": ["$type", "IN"]}, "$quantity", {"$multiply": ["$quantity", -1]}]
+        }}}}
+    ], allowDiskUse=True)}
+    archived = {r["_id"]: r["net"] for r in opening_balances.aggregate([
+        {"$match": id_range(part, "product_id")},
+        {"$group": {"_id": "$product_id", "net": {"$sum": "$net"}}}
+    ])}
+
+    result = {"checked": 0, "mismatches": 0, "repaired": 0, "noBaseline": 0, "orphans": 0}
+    findings = []
+    seen = set()
+    for p in products.find(id_range(part, "_id"), {"name": 1, "quantity": 1, "openingQuantity": 1}):
+        pid = p["_id"]
+        seen.add(pid)
+        result["checked"] += 1
+        actual = int(p.get("quantity", 0))
+        ledger = hot[pid]["net"] if pid in hot else 0
+        ledger += archived.get(pid, 0)
+
+        if "openingQuantity" not in p:
+            # Products from before openingQuantity was recorded: take today's stock as right
+            result["noBaseline"] += 1
+            if repair:
+                products.update_one({"_id": pid, "openingQuantity": {"$exists": False}},
+                                    {"$set": {"openingQuantity": actual - ledger}})
+            continue
+        if int(p["openingQuantity"]) + ledger == actual:
+            continue
+
+        # Movements keep landing while the partition is read: confirm alone,
+        # on a quantity that did not change around the ledger read
+        before = products.find_one({"_id": pid}, {"quantity": 1})
+        ledger = product_ledger_net(pid)
+        after = products.find_one({"_id": pid}, {"quantity": 1})
+        if not before or not after or before["quantity"] != after["quantity"]:
+            continue
+        actual = int(after["quantity"])
+        expected = int(p["openingQuantity"]) + ledger
+        if expected == actual:
+            continue
+
+        repaired = False
+        if repair:
+            # Compare-and-set: a movement in between wins and the next run re-checks
+            repaired = products.update_one(
+                {"_id": pid, "quantity": actual}, stock_update(expected - actual)
+            ).modified_count == 1
+        result["mismatches"] += 1
+        result["repaired"] += int(repaired)
+        findings.append({"run": run_id, "product_id": pid, "kind": "mismatch",
+                         "productName": p.get("name", ""), "expected": expected,
+                         "actual": actual, "repaired": repaired})
+
+    for pid, r in hot.items():
+        if pid not in seen:
+            result["orphans"] += 1
+            findings.append({"run": run_id, "product_id": pid, "kind": "orphan", "rows": r["rows"], "net": r["net"]})
+
+    # Upserts and $set keep a re-run partition (after a crash) from double counting
+    if findings:
+        reconcile_findings.bulk_write([
+            UpdateOne({"run": f["run"], "product_id": f["product_id"]}, {"$set": f}, upsert=True)
+            for f in findings
+        ], ordered=False)
+    reconcile_runs.update_one({"_id": run_id}, {"$set": {f"results.{index}": result}})
+    return result
+
+@bp.cli.command("reconcile-stock")
+@click.option("--repair", is_flag=True, help="Set mismatched quantities to the ledger value.")
+@click.option("--workers", default=4, show_default=True, help="Partitions checked in parallel.")
+@click.option("--partitions", default=64, show_default=True, help="Number of product id ranges.")
+@click.option("--resume", is_flag=True, help="Continue the latest unfinished run.")
+def reconcile_stock_command(repair, workers, partitions, resume):
+    """Recompute every product's quantity from the ledger and report (or repair) drift."""
+    # Rows an archive run has moved are in neither the hot ledger nor the
+    # opening balances until it finishes, so every such product would look drifted
+    if (stats.find_one({"_id": ARCHIVE_ID}) or {}).get("balancesFrom") is not None:
+        raise click.ClickException(
+            "An archive run is in progress or was interrupted; let `flask archive-transactions` finish first"
+        )
+    run = None
+    if resume:
+        run = reconcile_runs.find_one({"finishedAt": {"$exists": False}}, sort=[("startedAt", -1)])
+        if run is None:
+            print("Nothing to resume")
+            return
+        repair = run["repair"]
+    else:
+        run = {"_id": ObjectId(), "startedAt": ist_now(), "repair": repair,
+               "partitions": reconcile_partitions(partitions), "results": {}}
+        reconcile_runs.insert_one(run)
+
+    pending = [(i, part) for i, part in enumerate(run["partitions"]) if str(i) not in run.get("results", {})]
+    print(f"🔎 Run {run['_id']}: {len(pending)} of {len(run['partitions'])} partitions to check")
+
+    app = current_app._get_current_object()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_with_app_context, app, reconcile_partition, run["_id"], i, part, repair)
+                   for i, part in pending]
+        for done, future in enumerate(futures, 1):
+            r = future.result()
+            print(f"   … {done}/{len(pending)} partitions, {r['mismatches']} mismatches in the last")
+
+    results = reconcile_runs.find_one({"_id": run["_id"]})["results"].values()
+    totals = {k: sum(r[k] for r in results) for k in ("checked", "mismatches", "repaired", "noBaseline", "orphans")}
+    if totals["repaired"]:
+        rebuild_inventory_summary()
+    reconcile_runs.update_one({"_id": run["_id"]}, {"$set": dict(totals, finishedAt=ist_now())})
+
+    for f in reconcile_findings.find({"run": run["_id"], "kind": "mismatch"}).limit(RECONCILE_SAMPLE):
+        print(f"   {f['productName']}: quantity {f['actual']}, ledger says {f['expected']}"
+              + (" (repaired)" if f["repaired"] else ""))
+    print(f"✅ Checked {totals['checked']} products: {totals['mismatches']} mismatches, "
+          f"{totals['repaired']} repaired, {totals['orphans']} orphaned ledger products")
+    if totals["noBaseline"]:
+        print(f"   {totals['noBaseline']} products had no openingQuantity"
+              + (" and now take their current stock as correct" if repair else "; --repair records one"))
+
+# =====================================================
+# 📡 LIVE EVENTS (Server-Sent Events)
+# =====================================================
+# Each write inserts one document into the capped "events" collection. One
+# tailer thread per process fans it out to that process's open streams, so a
+# write costs the same whether 1 or 500 dashboards are connected.
+#
+# Events are numbered from a counter so a reconnecting client resumes with an
+# indexed range read. Idle streams only wait on a queue; under the gevent
+# workers of gunicorn.conf.py they are greenlets rather than OS threads.
+# EVENT_STREAMS_MAX caps them per process either way.
+EVENT_QUEUE_SIZE = 256
+EVENT_HEARTBEAT_SECONDS = 15
+EVENT_REPLAY_MAX = 1000
+EVENT_STREAMS_GEVENT = 1000
+EVENT_STREAMS_THREADED = 100
+# Seq values are taken before the insert, so one process's event can land
+# after another's with a higher seq. The tailer looks back this many seqs.
+EVENT_REORDER_WINDOW = 1000
+
+# Subscriber queues and the tailer's pid live in app_state()["events"], so each
+# app built by create_app() tails and fans out on its own
+event_lock = threading.Lock()
+
+def stock_event_item(product, ttype=None, qty=None):
+    item = {
+        "productId": str(product["_id"]),
+        "name": product.get("name", ""),
+        "quantity": int(product.get("quantity", 0)),
+        "stockLevel": product.get("stockLevel", "ok")
+    }
+    if ttype:
+        item.update(type=ttype, qty=qty)
+    return item
+
+def low_stock_event_item(product):
+    return {
+        "productId": str(product["_id"]),
+        "name": product.get("name", ""),
+        "quantity": int(product.get("quantity", 0)),
+        "lowStock": int(product.get("lowStock", 0)),
+        "level": product.get("stockLevel", "ok")
+    }
+
+def next_event_seq():
+    counter = stats.find_one_and_update(
+        {"_id": EVENT_SEQ_ID}, {"$inc": {"seq": 1}},
+        upsert=True, return_document=ReturnDocument.AFTER
+    )
+    return counter["seq"]
+
+def publish_change(stock=None, stats=None, low_stock=None):
+    # The write has already committed; a lost event must not fail the request
+    try:
+        doc = {"seq": next_event_seq(), "ts": datetime.utcnow()}
+        if stock:
+            doc["stock"] = stock
+        if stats:
+            doc["stats"] = stats
+        if low_stock:
+            doc["lowStock"] = low_stock
+        events.insert_one(doc)
+    except Exception as e:
+        print(f"❌ Publish event error: {str(e)}")
+
+def format_sse(doc):
+    chunks = []
+    for kind, key in (("stock", "stock"), ("low-stock", "lowStock"), ("stats", "stats")):
+        if key in doc:
+            chunks.append(f"id: {doc['seq']}\nevent: {kind}\ndata: {json.dumps(doc[key])}\n\n")
+    return "".join(chunks)
+
+def dispatch_event(doc):
+    subscribers = app_state()["events"]["subscribers"]
+    with event_lock:
+        targets = list(subscribers)
+    for q in targets:
+        try:
+            q.put_nowait(doc)
+        except queue.Full:
+            # A client that cannot keep up is dropped; it reconnects with Last-Event-ID
+            with event_lock:
+                subscribers.discard(q)
+
+def events_after(last_seq, limit):
+    return events.find({"seq": {"$gt": last_seq}}).sort("seq", 1).limit(limit)
+
+def parse_event_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def event_tailer_loop():
+    latest = events.find_one({"seq": {"$exists": True}}, sort=[("seq", -1)])
+    last_seq = latest["seq"] if latest else 0
+    # Ids inside the look-back window that need no dispatch: at start those
+    # already published, afterwards those already sent
+    recent = collections.deque(maxlen=EVENT_REORDER_WINDOW)
+    for doc in events.find({"seq": {"$gt": last_seq - EVENT_REORDER_WINDOW}}, {"_id": 1}):
+        recent.append(doc["_id"])
+    sent = set(recent)
+    while True:
+        try:
+            # The server applies the filter, so a restart ships only the window
+            cursor = events.find({"seq": {"$gt": last_seq - EVENT_REORDER_WINDOW}},
+                                 cursor_type=CursorType.TAILABLE_AWAIT)
+            while cursor.alive:
+                for doc in cursor:
+                    if doc["_id"] in sent:
+                        continue
+                    if len(recent) == recent.maxlen:
+                        sent.discard(recent[0])
+                    recent.append(doc["_id"])
+                    sent.add(doc["_id"])
+                    last_seq = max(last_seq, doc["seq"])
+                    dispatch_event(doc)
+        except Exception as e:
+            print(f"❌ Event tailer error: {str(e)}")
+        # Tailable cursors die on an empty collection or after a failover
+        time.sleep(1)
+
+def cooperative_workers():
+    # gunicorn's gevent worker patches threading before the app is imported
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched("threading")
+
+def event_streams_max():
+    configured = current_app.config["EVENT_STREAMS_MAX"]
+    if configured is not None:
+        return configured
+    return EVENT_STREAMS_GEVENT if cooperative_workers() else EVENT_STREAMS_THREADED
+
+def ensure_event_tailer():
+    state = app_state()["events"]
+    with event_lock:
+        if state["tailer_pid"] != os.getpid():
+            app = current_app._get_current_object()
+            threading.Thread(target=run_with_app_context, args=(app, event_tailer_loop),
+                             name="event-tailer", daemon=True).start()
+            state["tailer_pid"] = os.getpid()
+
+@bp.route("/api/events")
+def stream_events():
+    if not login_required():
+        return jsonify({"error": "Unauthorized"}), 403
+
+    ensure_event_tailer()
+    last_event_id = parse_event_id(request.headers.get("Last-Event-ID"))
+
+    # Taken now: the body is iterated after the app context is gone
+    subscribers = app_state()["events"]["subscribers"]
+    q = queue.Queue(maxsize=EVENT_QUEUE_SIZE)
+    with event_lock:
+        full = len(subscribers) >= event_streams_max()
+        if not full:
+            subscribers.add(q)
+    if full:
+        # EventSource gives up for good on an error status; an empty stream
+        # with a retry field makes it reconnect later (spread to avoid a stampede)
+        return Response(
+            f"retry: {random.randint(10000, 30000)}\n\n",
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache"}
+        )
+
+    # Opened here for the same reason
+    replay = events_after(last_event_id, EVENT_REPLAY_MAX) if last_event_id is not None else ()
+
+    def generate():
+        try:
+            yield "retry: 5000\n\n"
+            replayed = set()
+            # Catch up on what a reconnecting client missed
+            for doc in replay:
+                replayed.add(doc["_id"])
+                yield format_sse(doc)
+
+            while True:
+                with event_lock:
+                    if q not in subscribers:
+                        return
+                try:
+                    doc = q.get(timeout=EVENT_HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                if doc["_id"] in replayed:
+                    continue
+                yield format_sse(doc)
+        finally:
+            with event_lock:
+                subscribers.discard(q)
+
+    return Response(
+        generate(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 # =====================================================
 # 🔔 LOW STOCK
 # =====================================================
-@app.route("/low-stock")
+@bp.route("/low-stock")
 def low_stock():
     try:
         items = []
-        for p in products.find():
-            low_stock_threshold = int(p.get("lowStock", 0))
-            current_qty = int(p.get("quantity", 0))
-            
-            if low_stock_threshold > 0 and current_qty <= low_stock_threshold:
-                items.append({
-                    "name": p["name"],
-                    "quantity": current_qty,
-                    "lowStock": low_stock_threshold
-                })
+        critical = 0
+        for p in get_storage().low_stock_products():
+            critical += p["stockLevel"] == "critical"
+            items.append({
+                "name": p["name"],
+                "quantity": int(p.get("quantity", 0)),
+                "lowStock": int(p.get("lowStock", 0)),
+                "level": p["stockLevel"]
+            })
         
-        return jsonify({"count": len(items), "items": items}), 200
+        return jsonify({"count": len(items), "criticalCount": critical, "items": items}), 200
         
     except Exception as e:
         print(f"❌ Low stock error: {str(e)}")
         return jsonify({"error": "Failed to fetch low stock items"}), 500
-    
-@app.route("/promote", methods=["POST"])
+
+# =====================================================
+# 📈 REORDER FORECASTS (NumPy, batch)
+# =====================================================
+# `flask forecast-reorder` reads every product's daily OUT series from the
+# daily rollups in one aggregation and computes, for the whole catalog at once
+# with array math, the daily consumption rate and its spread, days until stock
+# runs out and a reorder point (lead-time demand plus safety stock). Results
+# land in "reorder_forecasts" for /api/reorder-suggestions. Schedule it daily
+# after the rollups settle, e.g. cron `15 0 * * * flask forecast-reorder`.
+FORECAST_BATCH_SIZE = 1000
+# Stockouts further out than this get no date (slow movers can be millions of days away)
+FORECAST_HORIZON_DAYS = 3650
+REORDER_PAGE_MAX = 500
+
+def compute_reorder_forecasts(days, lead_time, service_level):
+    end = ist_day(ist_now())
+    start = end - timedelta(days=days)
+    catalog = list(products.find({}, {"name": 1, "quantity": 1, "leadTimeDays": 1, "createdAt": 1}))
+    if not catalog:
+        return 0
+    index = {p["_id"]: i for i, p in enumerate(catalog)}
+
+    series = daily_rollups.aggregate([
+        {"$match": {"day": {"$gte": start, "$lt": end}, "product_id": {"$ne": None}, "outQty": {"$gt": 0}}},
+        {"$group": {"_id": "$product_id", "qty": {"$push": "$outQty"}}}
+    ], allowDiskUse=True)
+    rows, qty = [], []
+    for s in series:
+        if s["_id"] in index:
+            rows.append(np.full(len(s["qty"]), index[s["_id"]]))
+            qty.append(np.asarray(s["qty"], dtype=np.float64))
+    rows = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+    qty = np.concatenate(qty) if qty else np.zeros(0)
+
+    # Days without OUT are zeros, so sums over the recorded days are enough;
+    # products younger than the window are averaged over their own age
+    n = len(catalog)
+    total = np.bincount(rows, weights=qty, minlength=n)
+    squares = np.bincount(rows, weights=qty * qty, minlength=n)
+    window_end = ist_to_utc(end)
+    age = np.array([
+        (window_end - p["createdAt"]).total_seconds() / 86400 if p.get("createdAt") else days
+        for p in catalog
+    ])
+    active = np.clip(np.ceil(age), 1, days)
+
+    rate = total / active
+    variance = np.where(active > 1, (squares - active * rate ** 2) / np.maximum(active - 1, 1), 0.0)
+    spread = np.sqrt(np.maximum(variance, 0.0))
+
+    on_hand = np.array([int(p.get("quantity", 0)) for p in catalog], dtype=np.float64)
+    lead = np.array([p.get("leadTimeDays") or lead_time for p in catalog], dtype=np.float64)
+    z = NormalDist().inv_cdf(service_level)
+    safety = z * spread * np.sqrt(lead)
+    reorder_point = np.ceil(rate * lead + safety)
+    with np.errstate(divide="ignore"):
+        to_stockout = np.where(rate > 0, on_hand / rate, np.inf)
+    # Enough to cover the lead time again on top of the reorder point
+    order = np.where(on_hand <= reorder_point, np.ceil(reorder_point + rate * lead - on_hand), 0)
+
+    computed_at = ist_now()
+    ops = []
+    for i, p in enumerate(catalog):
+        days_left = None if np.isinf(to_stockout[i]) else round(float(to_stockout[i]), 1)
+        stockout_date = None
+        if days_left is not None and days_left <= FORECAST_HORIZON_DAYS:
+            stockout_date = end + timedelta(days=days_left)
+        ops.append(ReplaceOne({"_id": p["_id"]}, {
+            "productName": p.get("name", ""),
+            "quantity": int(on_hand[i]),
+            "dailyRate": round(float(rate[i]), 3),
+            "dailyStd": round(float(spread[i]), 3),
+            "leadTimeDays": float(lead[i]),
+            "safetyStock": int(np.ceil(safety[i])),
+            "reorderPoint": int(reorder_point[i]),
+            "suggestedOrder": int(max(order[i], 0)),
+            "daysToStockout": days_left,
+            "stockoutDate": stockout_date,
+            "windowDays": days,
+            "computedAt": computed_at
+        }, upsert=True))
+        if len(ops) >= FORECAST_BATCH_SIZE:
+            reorder_forecasts.bulk_write(ops, ordered=False)
+            ops = []
+    if ops:
+        reorder_forecasts.bulk_write(ops, ordered=False)
+    # Forecasts of products deleted since the last run
+    reorder_forecasts.delete_many({"computedAt": {"$lt": computed_at}})
+    return n
+
+@bp.cli.command("forecast-reorder")
+@click.option("--days", default=90, show_default=True, help="Days of OUT history to use.")
+@click.option("--lead-time", default=7.0, show_default=True,
+              help="Supplier lead time in days, for products without leadTimeDays.")
+@click.option("--service-level", default=0.95, show_default=True,
+              help="Chance of not running out during the lead time.")
+def forecast_reorder_command(days, lead_time, service_level):
+    """Compute consumption, days to stock-out and reorder points for every product."""
+    if np is None:
+        raise click.ClickException("NumPy is required for forecasting: pip install numpy")
+    if not 0 < service_level < 1:
+        raise click.BadParameter("must be between 0 and 1", param_hint="--service-level")
+    started = time.perf_counter()
+    count = compute_reorder_forecasts(days, lead_time, service_level)
+    print(f"✅ Forecast {count} products in {time.perf_counter() - started:.1f}s")
+
+# Query params: limit, all (1 = include products not yet at their reorder point)
+@bp.route("/api/reorder-suggestions")
+def reorder_suggestions():
+    try:
+        if not admin_required():
+            return jsonify({"error": "Unauthorized"}), 403
+
+        try:
+            limit = min(max(int(request.args.get("limit", 50)), 1), REORDER_PAGE_MAX)
+        except ValueError:
+            return jsonify({"error": "Invalid limit"}), 400
+
+        query = {"daysToStockout": {"$ne": None}}
+        if request.args.get("all") not in ("1", "true"):
+            query["suggestedOrder"] = {"$gt": 0}
+        rows = list(reorder_forecasts.find(query).sort([("daysToStockout", 1), ("_id", 1)]).limit(limit))
+
+        # Stock has moved since the batch ran: use live quantities for the days left
+        live = {p["_id"]: int(p.get("quantity", 0)) for p in products.find(
+            {"_id": {"$in": [r["_id"] for r in rows]}}, {"quantity": 1})}
+        result = []
+        for r in rows:
+            qty = live.get(r["_id"], r["quantity"])
+            rate = r["dailyRate"]
+            result.append({
+                "id": str(r["_id"]),
+                "productName": r["productName"],
+                "quantity": qty,
+                "dailyRate": rate,
+                "dailyStd": r["dailyStd"],
+                "daysToStockout": round(qty / rate, 1) if rate > 0 else None,
+                "reorderPoint": r["reorderPoint"],
+                "safetyStock": r["safetyStock"],
+                "suggestedOrder": r["suggestedOrder"],
+                "needsReorder": qty <= r["reorderPoint"],
+                "computedAt": r["computedAt"].isoformat()
+            })
+        return jsonify(result), 200
+
+    except Exception as e:
+        print(f"❌ Reorder suggestions error: {str(e)}")
+        return jsonify({"error": "Failed to fetch reorder suggestions"}), 500
+
+# =====================================================
+# 📧 LOW STOCK ALERTS (outbox + background sender)
+# =====================================================
+ALERTS_ID = "alerts"
+ALERT_POLL_SECONDS = 10
+ALERT_BATCH_MAX = 200
+ALERT_MAX_ATTEMPTS = 5
+ALERT_CLAIM_TIMEOUT = timedelta(minutes=5)
+
+LEVEL_SEVERITY = {"ok": 0, "low": 1, "critical": 2}
+
+DEFAULT_ALERT_SETTINGS = {
+    "enableAlerts": True,
+    "emailAlert": True,
+    "smsAlert": False,
+    "globalThreshold": 10
+}
+
+alert_sender_lock = threading.Lock()
+
+def get_alert_settings():
+    if not uses_mongo():
+        return dict(DEFAULT_ALERT_SETTINGS)
+    saved = stats.find_one({"_id": ALERTS_ID}) or {}
+    return {k: saved.get(k, v) for k, v in DEFAULT_ALERT_SETTINGS.items()}
+
+def queue_stock_alert(product):
+    queue_stock_alerts([product])
+
+def queue_stock_alerts(items):
+    """
+    Queue one outbox entry per product that got worse than the level it was
+    last alerted at. alertedLevel is claimed with a conditional update, so each
+    threshold crossing is queued once even under concurrent movements, and it
+    is cleared when stock recovers so the next crossing alerts again.
+    Any number of products costs one bulk_write, at most one read to tell which
+    claims won, and one insert_many.
+    """
+    ops = []
+    candidates = {}
+    claim = ObjectId()
+    for product in items:
+        level = product.get("stockLevel", "ok")
+        alerted = product.get("alertedLevel")
+
+        if level == "ok":
+            if alerted:
+                ops.append(UpdateOne({"_id": product["_id"], "stockLevel": "ok"}, {"$unset": {"alertedLevel": ""}}))
+            continue
+
+        if LEVEL_SEVERITY[level] <= LEVEL_SEVERITY.get(alerted, 0):
+            continue
+
+        covered = [lvl for lvl, sev in LEVEL_SEVERITY.items() if sev >= LEVEL_SEVERITY[level]]
+        ops.append(UpdateOne(
+            {"_id": product["_id"], "alertedLevel": {"$nin": covered}},
+            {"$set": {"alertedLevel": level, "alertClaim": claim}}
+        ))
+        candidates[product["_id"]] = product
+
+    if not ops:
+        return
+    result = products.bulk_write(ops, ordered=False)
+    if not candidates:
+        return
+
+    # With only claims in the batch, all-or-nothing outcomes need no read-back
+    if len(ops) == len(candidates) and result.modified_count in (0, len(candidates)):
+        claimed = list(candidates) if result.modified_count else []
+    else:
+        claimed = [p["_id"] for p in products.find(
+            {"_id": {"$in": list(candidates)}, "alertClaim": claim}, {"_id": 1}
+        )]
+    if not claimed:
+        return
+
+    now = datetime.utcnow()
+    alert_outbox.insert_many([
+        {
+            "product_id": pid,
+            "productName": candidates[pid].get("name", ""),
+            "quantity": int(candidates[pid].get("quantity", 0)),
+            "lowStock": int(candidates[pid].get("lowStock", 0)),
+            "level": candidates[pid]["stockLevel"],
+            "status": "pending",
+            "attempts": 0,
+            "createdAt": now
+        }
+        for pid in claimed
+    ])
+
+def alert_recipients():
+    if current_app.config["ALERT_TO"]:
+        return current_app.config["ALERT_TO"]
+    return [u["email"] for u in users.find({"role": "admin"}, {"email": 1})]
+
+def send_alert_digest(items, recipients):
+    msg = EmailMessage()
+    critical = sum(1 for i in items if i["level"] == "critical")
+    msg["Subject"] = f"SmartStock: {len(items)} low stock alert(s)" + (f", {critical} critical" if critical else "")
+    msg["From"] = current_app.config["ALERT_FROM"]
+    msg["To"] = ", ".join(recipients)
+
+    lines = ["The following products need restocking:", ""]
+    for i in sorted(items, key=lambda i: (-LEVEL_SEVERITY[i["level"]], i["productName"])):
+        lines.append(f"- [{i['level'].upper()}] {i['productName']}: {i['quantity']} left (alert level {i['lowStock']})")
+    msg.set_content("\n".join(lines))
+
+    with smtplib.SMTP(current_app.config["SMTP_HOST"], current_app.config["SMTP_PORT"], timeout=10) as smtp:
+        if current_app.config["SMTP_USE_TLS"]:
+            smtp.starttls()
+        if current_app.config["SMTP_USER"]:
+            smtp.login(current_app.config["SMTP_USER"], current_app.config["SMTP_PASSWORD"])
+        smtp.send_message(msg)
+
+def drain_alert_outbox():
+    """Claim pending alerts, send them as one digest and log them. Returns the number sent."""
+    claim = uuid.uuid4().hex
+    now = datetime.utcnow()
+
+    # Claim a batch atomically; stale claims from a crashed sender are taken over
+    pending = [a["_id"] for a in alert_outbox.find(
+        {"$or": [
+            {"status": "pending"},
+            {"status": "sending", "claimedAt": {"$lt": now - ALERT_CLAIM_TIMEOUT}}
+        ]},
+        {"_id": 1}
+    ).sort("createdAt", 1).limit(ALERT_BATCH_MAX)]
+    if not pending:
+        return 0
+
+    alert_outbox.update_many(
+        {"_id": {"$in": pending}, "$or": [
+            {"status": "pending"},
+            {"status": "sending", "claimedAt": {"$lt": now - ALERT_CLAIM_TIMEOUT}}
+        ]},
+        {"$set": {"status": "sending", "claim": claim, "claimedAt": now}}
+    )
+    items = list(alert_outbox.find({"claim": claim}))
+    if not items:
+        return 0
+
+    settings = get_alert_settings()
+    if not (settings["enableAlerts"] and settings["emailAlert"]):
+        alert_outbox.delete_many({"claim": claim})
+        return 0
+
+    recipients = alert_recipients()
+    try:
+        if not recipients:
+            raise RuntimeError("No alert recipients configured")
+        send_alert_digest(items, recipients)
+    except Exception as e:
+        print(f"❌ Alert email failed: {str(e)}")
+        alert_outbox.update_many(
+            {"claim": claim, "attempts": {"$lt": ALERT_MAX_ATTEMPTS - 1}},
+            {"$set": {"status": "pending", "lastError": str(e)}, "$inc": {"attempts": 1}, "$unset": {"claim": ""}}
+        )
+        alert_outbox.update_many(
+            {"claim": claim},
+            {"$set": {"status": "failed", "lastError": str(e)}, "$inc": {"attempts": 1}}
+        )
+        return 0
+
+    sent_at = datetime.utcnow()
+    email_logs.insert_many([
+        {
+            "product_id": i["product_id"],
+            "product": i["productName"],
+            "quantity": i["quantity"],
+            "level": i["level"],
+            "recipients": recipients,
+            "sentAt": sent_at
+        }
+        for i in items
+    ])
+    alert_outbox.delete_many({"claim": claim})
+    print(f"📧 Low stock digest sent: {len(items)} alert(s) to {len(recipients)} recipient(s)")
+    return len(items)
+
+def alert_sender_loop():
+    while True:
+        try:
+            # Keep draining while full batches are coming back
+            while drain_alert_outbox() >= ALERT_BATCH_MAX:
+                pass
+        except Exception as e:
+            print(f"❌ Alert sender error: {str(e)}")
+        time.sleep(ALERT_POLL_SECONDS)
+
+@bp.before_app_request
+def start_alert_sender():
+    # Started lazily so every (possibly forked) worker process, and every app
+    # in it, gets its own thread
+    state = app_state()
+    if state["alert_sender_pid"] == os.getpid() or not uses_mongo():
+        return
+    with alert_sender_lock:
+        if state["alert_sender_pid"] != os.getpid():
+            app = current_app._get_current_object()
+            threading.Thread(target=run_with_app_context, args=(app, alert_sender_loop),
+                             name="alert-sender", daemon=True).start()
+            state["alert_sender_pid"] = os.getpid()
+
+@bp.cli.command("drain-alerts")
+def drain_alerts_command():
+    """Send all pending low stock alerts now."""
+    total = 0
+    while True:
+        sent = drain_alert_outbox()
+        total += sent
+        if sent < ALERT_BATCH_MAX:
+            break
+    print(f"✅ {total} alert(s) sent")
+
+@bp.route("/low-stock-alert", methods=["POST"])
+def low_stock_alert():
+    try:
+        if not login_required():
+            return jsonify({"error": "Unauthorized"}), 403
+
+        # Only queues alerts; the background sender does the SMTP work
+        pending = [
+            p for p in products.find(
+                {"stockLevel": {"$in": LOW_STOCK_LEVELS}},
+                {"name": 1, "quantity": 1, "lowStock": 1, "stockLevel": 1, "alertedLevel": 1}
+            )
+            if LEVEL_SEVERITY[p["stockLevel"]] > LEVEL_SEVERITY.get(p.get("alertedLevel"), 0)
+        ]
+        queue_stock_alerts(pending)
+        queued = len(pending)
+
+        return jsonify({"message": "Low stock alerts queued", "queued": queued}), 202
+
+    except Exception as e:
+        print(f"❌ Low stock alert error: {str(e)}")
+        return jsonify({"error": "Failed to queue alerts"}), 500
+
+@bp.route("/email-logs")
+def get_email_logs():
+    try:
+        if not admin_required():
+            return jsonify({"error": "Unauthorized"}), 403
+
+        logs = []
+        for e in email_logs.find().sort("sentAt", -1).limit(200):
+            logs.append({
+                "product": e.get("product", ""),
+                "quantity": int(e.get("quantity", 0)),
+                "level": e.get("level", "low"),
+                # Stored as naive UTC; say so, unlike the naive-IST ledger dates
+                "sentAt": e["sentAt"].isoformat(timespec="seconds") + "Z"
+            })
+
+        return jsonify(logs), 200
+
+    except Exception as e:
+        print(f"❌ Email logs error: {str(e)}")
+        return jsonify({"error": "Failed to fetch email logs"}), 500
+
+@bp.route("/alert-settings", methods=["GET", "POST"])
+def alert_settings():
+    try:
+        if not admin_required():
+            return jsonify({"error": "Unauthorized"}), 403
+
+        if request.method == "GET":
+            return jsonify(get_alert_settings()), 200
+
+        data = request.json or {}
+        settings = {
+            "enableAlerts": bool(data.get("enableAlerts", True)),
+            "emailAlert": bool(data.get("emailAlert", True)),
+            "smsAlert": bool(data.get("smsAlert", False)),
+            "globalThreshold": int(data.get("globalThreshold") or DEFAULT_ALERT_SETTINGS["globalThreshold"])
+        }
+        stats.update_one({"_id": ALERTS_ID}, {"$set": settings}, upsert=True)
+
+        return jsonify({"message": "Alert settings saved"}), 200
+
+    except Exception as e:
+        print(f"❌ Alert settings error: {str(e)}")
+        return jsonify({"error": "Failed to save alert settings"}), 500
+
+@bp.route("/promote", methods=["POST"])
 def promote_user():
     try:
         if not admin_required():
@@ -447,12 +2983,7 @@ def promote_user():
         if email == session.get("email"):
             return jsonify({"error": "You cannot promote yourself"}), 400
 
-        result = users.update_one(
-            {"email": email},
-            {"$set": {"role": "admin"}}
-        )
-
-        if result.matched_count == 0:
+        if not get_storage().set_user_role(email, "admin"):
             return jsonify({"error": "User not found"}), 404
 
         return jsonify({"message": "User promoted to admin"}), 200
@@ -461,7 +2992,7 @@ def promote_user():
         print("❌ Promote error:", e)
         return jsonify({"error": "Failed to promote user"}), 500
     
-@app.route("/demote", methods=["POST"])
+@bp.route("/demote", methods=["POST"])
 def demote_user():
     try:
         if not admin_required():
@@ -476,12 +3007,7 @@ def demote_user():
         if email == session.get("email"):
             return jsonify({"error": "You cannot demote yourself"}), 400
 
-        result = users.update_one(
-            {"email": email},
-            {"$set": {"role": "employee"}}
-        )
-
-        if result.matched_count == 0:
+        if not get_storage().set_user_role(email, "employee"):
             return jsonify({"error": "User not found"}), 404
 
         return jsonify({"message": "User demoted to employee"}), 200
@@ -490,7 +3016,7 @@ def demote_user():
         print("❌ Demote error:", e)
         return jsonify({"error": "Failed to demote user"}), 500
     
-@app.route("/delete-user", methods=["POST"])
+@bp.route("/delete-user", methods=["POST"])
 def delete_user():
     try:
         if not admin_required():
@@ -505,9 +3031,7 @@ def delete_user():
         if email == session.get("email"):
             return jsonify({"error": "You cannot delete yourself"}), 400
 
-        result = users.delete_one({"email": email})
-
-        if result.deleted_count == 0:
+        if not get_storage().delete_user(email):
             return jsonify({"error": "User not found"}), 404
 
         return jsonify({"message": "User deleted successfully"}), 200
@@ -522,16 +3046,12 @@ def delete_user():
 # =====================================================
 # 💰 INVENTORY VALUE
 # =====================================================
-@app.route("/inventory-value")
+@bp.route("/inventory-value")
 def inventory_value():
     try:
-        total = 0
-        for p in products.find():
-            qty = int(p.get("quantity", 0))
-            cost = float(p.get("costPrice", 0))
-            total += qty * cost
+        summary = get_storage().inventory_summary()
         
-        return jsonify({"inventoryValue": round(total, 2)}), 200
+        return jsonify({"inventoryValue": round(summary.get("totalValue", 0), 2)}), 200
         
     except Exception as e:
         print(f"❌ Inventory value error: {str(e)}")
@@ -540,31 +3060,29 @@ def inventory_value():
 # =====================================================
 # 📊 DASHBOARD STATS
 # =====================================================
-@app.route("/api/stats")
+@bp.route("/api/stats")
 def get_stats():
     try:
         if not login_required():
             return jsonify({"error": "Unauthorized"}), 403
         
-        total_products = products.count_documents({})
-        low_stock_count = products.count_documents({
-            "$expr": {"$lte": ["$quantity", "$lowStock"]}
-        })
-        
-        total_value = sum(
-            int(p.get("quantity", 0)) * float(p.get("costPrice", 0))
-            for p in products.find()
-        )
+        storage = get_storage()
+        summary = storage.inventory_summary()
+        critical_count = summary["criticalCount"]
         
-        recent_transactions = transactions.count_documents({
-            "date": {"$gte": datetime.utcnow().replace(hour=0, minute=0, second=0)}
-        })
+        today = storage.movements_today(ist_day(ist_now()))
+        today_in = int(today.get("inCount", 0))
+        today_out = int(today.get("outCount", 0))
         
         return jsonify({
-            "totalProducts": total_products,
-            "lowStockItems": low_stock_count,
-            "inventoryValue": round(total_value, 2),
-            "todayTransactions": recent_transactions
+            "totalProducts": summary.get("productCount", 0),
+            "lowStockItems": summary.get("lowStockCount", 0),
+            "criticalStockItems": critical_count,
+            "inventoryValue": round(summary.get("totalValue", 0), 2),
+            "todayTransactions": today_in + today_out,
+            "todayIn": today_in,
+            "todayOut": today_out,
+            "itemsMovedToday": int(today.get("inQty", 0)) + int(today.get("outQty", 0))
         }), 200
         
     except Exception as e:
@@ -574,48 +3092,556 @@ def get_stats():
 # =====================================================
 # 📤 EXPORT CSV
 # =====================================================
-@app.route("/export/inventory-csv")
+EXPORT_CHUNK_ROWS = 500
+
+INVENTORY_CSV_HEADER = ["Name", "Category", "Supplier", "Qty", "LowStock", "Cost", "Total Value"]
+INVENTORY_CSV_FIELDS = {"name": 1, "category": 1, "supplier": 1, "quantity": 1, "lowStock": 1, "costPrice": 1}
+
+TRANSACTION_CSV_HEADER = ["Date", "Product", "Type", "Qty", "User"]
+
+class _CSVLine:
+    # File-like sink that hands each formatted CSV line straight back
+    def write(self, value):
+        return value
+
+def stream_csv(header, rows):
+    """Yield CSV text in chunks of EXPORT_CHUNK_ROWS rows without buffering the file."""
+    writer = csv.writer(_CSVLine())
+    chunk = [writer.writerow(header)]
+    for row in rows:
+        chunk.append(writer.writerow(row))
+        if len(chunk) >= EXPORT_CHUNK_ROWS:
+            yield "".join(chunk)
+            chunk = []
+    if chunk:
+        yield "".join(chunk)
+
+def csv_response(chunks, filename):
+    return Response(
+        stream_with_context(chunks),
+        mimetype="text/csv",
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
+
+def inventory_csv_row(p):
+    qty = int(p.get("quantity", 0))
+    cost = float(p.get("costPrice", 0))
+    return [
+        p.get("name", ""),
+        p.get("category", ""),
+        p.get("supplier", ""),
+        qty,
+        p.get("lowStock", 0),
+        cost,
+        round(qty * cost, 2)
+    ]
+
+def transaction_csv_row(t):
+    tx_date = t.get("date")
+    return [
+        tx_date.isoformat() if isinstance(tx_date, datetime) else str(tx_date),
+        t.get("productName", "Unknown Product"),
+        t.get("type"),
+        int(t.get("quantity", 0)),
+        t.get("user", "N/A")
+    ]
+
+@bp.route("/export/inventory-csv")
 def export_inventory_csv():
     try:
         if not admin_required():
-            return redirect(url_for("login_page"))
-
-        output = StringIO()
-        writer = csv.writer(output)
-        writer.writerow(["Name", "Category", "Supplier", "Qty", "LowStock", "Cost", "Total Value"])
-
-        for p in products.find():
-            qty = int(p.get("quantity", 0))
-            cost = float(p.get("costPrice", 0))
-            writer.writerow([
-                p.get("name", ""),
-                p.get("category", ""),
-                p.get("supplier", ""),
-                qty,
-                p.get("lowStock", 0),
-                cost,
-                round(qty * cost, 2)
-            ])
-
-        output.seek(0)
-        return Response(
-            output.getvalue(),
-            mimetype="text/csv",
-            headers={"Content-Disposition": "attachment; filename=inventory.csv"}
-        )
+            return redirect(url_for(".login_page"))
+
+        rows = (inventory_csv_row(p) for p in get_storage().list_products(INVENTORY_CSV_FIELDS))
+
+        return csv_response(stream_csv(INVENTORY_CSV_HEADER, rows), "inventory.csv")
         
     except Exception as e:
         print(f"❌ Export error: {str(e)}")
         return jsonify({"error": "Failed to export CSV"}), 500
 
+# Query params: from, to, product_id, type, user (same as /api/transactions)
+@bp.route("/export/transactions-csv")
+def export_transactions_csv():
+    try:
+        if not admin_required():
+            return redirect(url_for(".login_page"))
+
+        storage = get_storage()
+        spec, error = parse_transaction_filters(request.args, storage.parse_id)
+        if error:
+            return jsonify({"error": error}), 400
+
+        rows = (transaction_csv_row(t) for t in storage.iter_transactions(spec))
+
+        return csv_response(stream_csv(TRANSACTION_CSV_HEADER, rows), "transactions.csv")
+
+    except Exception as e:
+        print(f"❌ Transaction export error: {str(e)}")
+        return jsonify({"error": "Failed to export CSV"}), 500
+
+# =====================================================
+# 📥 PRODUCT IMPORT (CSV)
+# =====================================================
+# Takes the columns of /export/inventory-csv (Total Value is ignored) plus an
+# optional SKU column. Rows are validated one at a time and upserted in
+# unordered bulk_writes of IMPORT_BATCH_SIZE, keyed on SKU when given, else on
+# name, so only one batch is ever held in memory. Qty only seeds new
+# products: stock on existing ones moves through transactions, keeping the
+# ledger the source of truth.
+IMPORT_BATCH_SIZE = 1000
+# Errors returned inline by the endpoint; the CLI writes every one to a file
+IMPORT_ERROR_LIMIT = 1000
+IMPORT_COLUMNS = {"name": "Name", "category": "Category", "supplier": "Supplier",
+                  "quantity": "Qty", "lowStock": "LowStock", "costPrice": "Cost", "sku": "SKU"}
+
+def parse_import_row(row, default_low):
+    """Validate one CSV row. Returns (fields, error)."""
+    def text(key):
+        return (row.get(IMPORT_COLUMNS[key]) or "").strip()
+
+    def number(key, cast, default):
+        raw = text(key).replace(",", "")
+        if not raw:
+            return default
+        try:
+            value = cast(raw)
+        except ValueError:
+            raise ValueError(f"{IMPORT_COLUMNS[key]} must be a number")
+        if value < 0:
+            raise ValueError(f"{IMPORT_COLUMNS[key]} must not be negative")
+        return value
+
+    name = text("name")
+    if not name:
+        return None, "Name is required"
+    try:
+        fields = {
+            "name": name,
+            "category": text("category"),
+            "supplier": text("supplier"),
+            "quantity": number("quantity", int, 0),
+            "lowStock": number("lowStock", int, default_low),
+            "costPrice": number("costPrice", float, 0.0)
+        }
+    except ValueError as e:
+        return None, str(e)
+    if text("sku"):
+        fields["sku"] = text("sku")
+    return fields, None
+
+def import_upsert(fields, now):
+    """
+    Pipeline upsert: catalog fields are replaced, stock is only set on insert.
+    CSV values go in as $literal: inside a pipeline a string such as
+    "$5 Gift Card" would otherwise be read as a field path.
+    """
+    key = {"sku": fields["sku"]} if "sku" in fields else {"name": fields["name"]}
+    value = {f: {"$literal": v} for f, v in fields.items()}
+    low = value["lowStock"]
+    return UpdateOne(key, [
+        {"$set": {
+            "name": value["name"],
+            "nameKey": {"$literal": search_key(fields["name"])},
+            "category": value["category"],
+            "supplier": value["supplier"],
+            "lowStock": low,
+            "criticalStock": {"$min": [
+                {"$ifNull": ["$criticalStock", default_critical_stock(fields["lowStock"])]}, low
+            ]},
+            "costPrice": value["costPrice"],
+            "quantity": {"$ifNull": ["$quantity", value["quantity"]]},
+            "openingQuantity": {"$ifNull": ["$openingQuantity", value["quantity"]]},
+            "createdAt": {"$ifNull": ["$createdAt", now]}
+        }},
+        {"$set": {"stockLevel": stock_level_expr(), "stockValue": stock_value_expr()}}
+    ], upsert=True)
+
+def import_products(reader, on_error):
+    """Apply csv.DictReader rows in batches; on_error(row_number, message) gets each rejection."""
+    if "Name" not in (reader.fieldnames or []):
+        raise ValueError("Missing column: Name")
+
+    default_low = get_alert_settings()["globalThreshold"]
+    summary = {"rows": 0, "inserted": 0, "updated": 0, "failed": 0}
+    # ops[i] came from CSV line line_numbers[i] and matches on batch_keys[i],
+    # a ("sku" | "name", value) pair
+    ops, line_numbers, batch_keys, keys = [], [], [], set()
+
+    def queue_alerts():
+        # Imported thresholds can move a product in or out of low stock:
+        # re-check the batch's products that are low or were alerted before
+        skus = [value for field, value in batch_keys if field == "sku"]
+        names = [value for field, value in batch_keys if field == "name"]
+        queue_stock_alerts(list(products.find(
+            {"$and": [
+                {"$or": [{"sku": {"$in": skus}}, {"name": {"$in": names}}]},
+                {"$or": [{"stockLevel": {"$in": LOW_STOCK_LEVELS}}, {"alertedLevel": {"$exists": True}}]}
+            ]},
+            {"name": 1, "quantity": 1, "lowStock": 1, "stockLevel": 1, "alertedLevel": 1}
+        )))
+
+    def flush():
+        if not ops:
+            return
+        try:
+            result = products.bulk_write(ops, ordered=False)
+        except BulkWriteError as e:
+            result = None
+            details = e.details
+            for err in details["writeErrors"]:
+                on_error(line_numbers[err["index"]], err.get("errmsg", "Write failed"))
+            summary["failed"] += len(details["writeErrors"])
+            summary["inserted"] += details.get("nUpserted", 0)
+            summary["updated"] += details.get("nMatched", 0)
+        if result is not None:
+            summary["inserted"] += result.upserted_count
+            summary["updated"] += result.matched_count
+        queue_alerts()
+        ops.clear()
+        line_numbers.clear()
+        batch_keys.clear()
+        keys.clear()
+
+    now = datetime.utcnow()
+    # Data starts on line 2, after the header
+    for line, row in enumerate(reader, start=2):
+        summary["rows"] += 1
+        fields, error = parse_import_row(row, default_low)
+        if error:
+            summary["failed"] += 1
+            on_error(line, error)
+            continue
+        # Unordered writes to one key in one batch could insert it twice
+        key = fields.get("sku") or fields["name"]
+        if key in keys:
+            flush()
+        keys.add(key)
+        ops.append(import_upsert(fields, now))
+        line_numbers.append(line)
+        batch_keys.append(("sku", fields["sku"]) if "sku" in fields else ("name", fields["name"]))
+        if len(ops) >= IMPORT_BATCH_SIZE:
+            flush()
+    flush()
+
+    if summary["inserted"] or summary["updated"]:
+        # Updates matched by SKU can rename a product
+        bump_product_names()
+        before = get_inventory_summary()
+        after = rebuild_inventory_summary()
+        publish_change(stats={f: after[f] - before.get(f, 0)
+                              for f in ("totalValue", "productCount", "lowStockCount")})
+    return summary
+
+@bp.route("/api/products/import", methods=["POST"])
+def import_products_route():
+    try:
+        if not admin_required():
+            return jsonify({"error": "Unauthorized"}), 403
+
+        # Multipart uploads are spooled to disk by Werkzeug; a raw text/csv
+        # body is read straight off the socket
+        upload = request.files.get("file")
+        stream = upload.stream if upload else request.stream
+        reader = csv.DictReader(io.TextIOWrapper(stream, encoding="utf-8-sig", newline=""))
+
+        errors = []
+        def on_error(line, message):
+            if len(errors) < IMPORT_ERROR_LIMIT:
+                errors.append({"row": line, "error": message})
+
+        try:
+            summary = import_products(reader, on_error)
+        except (ValueError, UnicodeDecodeError, csv.Error) as e:
+            return jsonify({"error": f"Invalid CSV: {str(e)}"}), 400
+
+        summary["errors"] = errors
+        summary["errorsTruncated"] = summary["failed"] > len(errors)
+        return jsonify(summary), 200
+
+    except Exception as e:
+        print(f"❌ Product import error: {str(e)}")
+        return jsonify({"error": "Failed to import products"}), 500
+
+@bp.cli.command("import-products")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--errors", "errors_path", type=click.Path(dir_okay=False),
+              help="Write rejected rows (line, error) to this CSV file.")
+def import_products_command(path, errors_path):
+    """Upsert products from a CSV in the inventory export format."""
+    report = open(errors_path, "w", newline="") if errors_path else None
+    writer = csv.writer(report) if report else None
+    if writer:
+        writer.writerow(["Line", "Error"])
+
+    def on_error(line, message):
+        if writer:
+            writer.writerow([line, message])
+        else:
+            print(f"   line {line}: {message}")
+
+    try:
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            summary = import_products(csv.DictReader(f), on_error)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    finally:
+        if report:
+            report.close()
+
+    print(f"✅ {summary['rows']} rows: {summary['inserted']} added, "
+          f"{summary['updated']} updated, {summary['failed']} rejected")
+
+# =====================================================
+# 🧾 BACKGROUND REPORTS (PDF & CSV)
+# =====================================================
+REPORT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "report_cache")
+REPORT_WORKERS = 2
+REPORT_MAX_PENDING = 20
+REPORT_PDF_ROWS_PER_TABLE = 500
+
+REPORT_TYPES = ("inventory", "low-stock", "transactions", "transaction-summary")
+REPORT_FORMATS = ("pdf", "csv")
+
+report_pool = {"executor": None, "pid": None}
+report_pool_lock = threading.Lock()
+report_slots = threading.BoundedSemaphore(REPORT_MAX_PENDING)
+
+def get_report_pool():
+    # Executor threads do not survive a fork, so each process builds its own
+    if report_pool["pid"] != os.getpid():
+        with report_pool_lock:
+            if report_pool["pid"] != os.getpid():
+                report_pool["executor"] = ThreadPoolExecutor(max_workers=REPORT_WORKERS)
+                report_pool["pid"] = os.getpid()
+    return report_pool["executor"]
+
+def report_rows(report_type, params):
+    """Return (title, header, row iterator) for a report type."""
+    if report_type == "inventory":
+        cursor = products.find({}, INVENTORY_CSV_FIELDS).sort("name", 1).batch_size(EXPORT_BATCH_SIZE)
+        return "Inventory Report", INVENTORY_CSV_HEADER, (inventory_csv_row(p) for p in cursor)
+
+    if report_type == "low-stock":
+        cursor = products.find(LOW_STOCK_QUERY, INVENTORY_CSV_FIELDS).sort("name", 1).batch_size(EXPORT_BATCH_SIZE)
+        return "Low Stock Report", INVENTORY_CSV_HEADER, (inventory_csv_row(p) for p in cursor)
+
+    if report_type == "transaction-summary":
+        return ("Transaction Summary Report", TRANSACTION_SUMMARY_HEADER,
+                transaction_summary_rows(params))
+
+    spec, error = parse_transaction_filters(params, to_object_id)
+    if error:
+        raise ValueError(error)
+    rows = get_storage().iter_transactions(spec)
+    return "Transaction History Report", TRANSACTION_CSV_HEADER, (transaction_csv_row(t) for t in rows)
+
+TRANSACTION_SUMMARY_HEADER = ["Product", "IN Count", "IN Qty", "OUT Count", "OUT Qty", "Net"]
+
+def transaction_summary_rows(params):
+    # Reads daily rollups, so cost follows the number of days, not ledger rows
+    day_range, error = rollup_day_range(params)
+    if error:
+        raise ValueError(error)
+    grouped = daily_rollups.aggregate([
+        {"$match": {"product_id": {"$ne": None}, "day": day_range}},
+        {"$group": dict({"_id": "$product_id", "productName": {"$last": "$productName"}},
+                        **{f: {"$sum": f"${f}"} for f in ROLLUP_FIELDS})},
+        {"$sort": {"productName": 1}}
+    ], allowDiskUse=True)
+    for r in grouped:
+        yield [r.get("productName", ""), r["inCount"], r["inQty"], r["outCount"], r["outQty"],
+               r["inQty"] - r["outQty"]]
+
+def write_csv_report(path, header, rows):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        for chunk in stream_csv(header, rows):
+            f.write(chunk)
+
+def write_pdf_report(path, title, header, rows):
+    styles = getSampleStyleSheet()
+    doc = SimpleDocTemplate(path, pagesize=landscape(A4), title=title)
+    story = [
+        Paragraph(f"SmartStock – {title}", styles["Title"]),
+        Paragraph(f"Generated {ist_now().strftime('%Y-%m-%d %H:%M')} IST", styles["Normal"]),
+        Spacer(1, 12)
+    ]
+    style = TableStyle([
+        ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#1f2937")),
+        ("TEXTCOLOR", (0, 0), (-1, 0), colors.white),
+        ("GRID", (0, 0), (-1, -1), 0.25, colors.grey),
+        ("FONTSIZE", (0, 0), (-1, -1), 8)
+    ])
+
+    # Several bounded tables keep ReportLab's layout cost linear on big catalogs
+    chunk = []
+    for row in rows:
+        chunk.append([str(v) for v in row])
+        if len(chunk) >= REPORT_PDF_ROWS_PER_TABLE:
+            story.append(Table([header] + chunk, repeatRows=1, style=style))
+            chunk = []
+    if chunk or len(story) == 3:
+        story.append(Table([header] + chunk, repeatRows=1, style=style))
+
+    doc.build(story)
+
+def report_cache_path(report_type, fmt, params, version):
+    params_key = hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()[:16]
+    prefix = f"{report_type}-{params_key}-"
+    return prefix, os.path.join(REPORT_CACHE_DIR, f"{prefix}{version}.{fmt}")
+
+def run_report_job(job_id, report_type, fmt, params, prefix, path):
+    try:
+        report_jobs.update_one({"_id": job_id}, {"$set": {"status": "running"}})
+        read_routing.route = "reports"
+        title, header, rows = report_rows(report_type, params)
+
+        tmp_path = f"{path}.{job_id}.tmp"
+        if fmt == "pdf":
+            write_pdf_report(tmp_path, title, header, rows)
+        else:
+            write_csv_report(tmp_path, header, rows)
+        os.replace(tmp_path, path)
+
+        # Older versions of the same report are never served again
+        for name in os.listdir(REPORT_CACHE_DIR):
+            if name.startswith(prefix) and name.endswith(f".{fmt}") and os.path.join(REPORT_CACHE_DIR, name) != path:
+                os.remove(os.path.join(REPORT_CACHE_DIR, name))
+
+        report_jobs.update_one({"_id": job_id}, {"$set": {"status": "done", "finishedAt": datetime.utcnow()}})
+    except Exception as e:
+        print(f"❌ Report job {job_id} failed: {str(e)}")
+        traceback.print_exc()
+        report_jobs.update_one({"_id": job_id}, {"$set": {"status": "failed", "error": str(e)}})
+    finally:
+        read_routing.route = None
+        report_slots.release()
+
+def report_job_json(job):
+    return {
+        "jobId": str(job["_id"]),
+        "type": job["type"],
+        "format": job["format"],
+        "status": job["status"],
+        "error": job.get("error")
+    }
+
+@bp.route("/api/reports", methods=["POST"])
+def submit_report():
+    try:
+        if not admin_required():
+            return jsonify({"error": "Unauthorized"}), 403
+
+        data = request.json or {}
+        report_type = data.get("type")
+        fmt = data.get("format", "pdf")
+        params = {k: v for k, v in (data.get("params") or {}).items()
+                  if k in ("from", "to", "product_id", "type", "user") and v}
+
+        if report_type not in REPORT_TYPES:
+            return jsonify({"error": f"type must be one of {', '.join(REPORT_TYPES)}"}), 400
+        if fmt not in REPORT_FORMATS:
+            return jsonify({"error": "format must be pdf or csv"}), 400
+        if fmt == "pdf" and SimpleDocTemplate is None:
+            return jsonify({"error": "PDF reports require ReportLab to be installed"}), 501
+        if report_type == "transactions":
+            _, error = build_transaction_query(params)
+            if error:
+                return jsonify({"error": error}), 400
+        elif report_type == "transaction-summary":
+            params = {k: v for k, v in params.items() if k in ("from", "to")}
+            day_range, error = rollup_day_range(params)
+            if error:
+                return jsonify({"error": error}), 400
+            # Pin the default window so the cache key reflects the actual days
+            params = {"from": day_range["$gte"].strftime("%Y-%m-%d"), "to": day_range["$lte"].strftime("%Y-%m-%d")}
+        else:
+            params = {}
+
+        os.makedirs(REPORT_CACHE_DIR, exist_ok=True)
+        # A rollup backfill changes transaction summaries without touching the summary version
+        version = f"{data_version()}.{rollups_version()}"
+        prefix, path = report_cache_path(report_type, fmt, params, version)
+
+        job = {
+            "_id": ObjectId(),
+            "type": report_type,
+            "format": fmt,
+            "params": params,
+            "path": path,
+            "user": session.get("email"),
+            "createdAt": datetime.utcnow()
+        }
+
+        if os.path.exists(path):
+            job["status"] = "done"
+            report_jobs.insert_one(job)
+            return jsonify(report_job_json(job)), 200
+
+        if not report_slots.acquire(blocking=False):
+            return jsonify({"error": "Too many reports in progress, try again shortly"}), 429
+
+        job["status"] = "queued"
+        report_jobs.insert_one(job)
+        get_report_pool().submit(run_with_app_context, current_app._get_current_object(),
+                                 run_report_job, job["_id"], report_type, fmt, params, prefix, path)
+
+        return jsonify(report_job_json(job)), 202
+
+    except Exception as e:
+        print(f"❌ Submit report error: {str(e)}")
+        traceback.print_exc()
+        return jsonify({"error": "Failed to submit report"}), 500
+
+@bp.route("/api/reports/<job_id>")
+def report_status(job_id):
+    try:
+        if not admin_required():
+            return jsonify({"error": "Unauthorized"}), 403
+
+        job = report_jobs.find_one({"_id": to_object_id(job_id)})
+        if not job:
+            return jsonify({"error": "Report job not found"}), 404
+
+        return jsonify(report_job_json(job)), 200
+
+    except Exception as e:
+        print(f"❌ Report status error: {str(e)}")
+        return jsonify({"error": "Failed to fetch report status"}), 500
+
+@bp.route("/api/reports/<job_id>/download")
+def download_report(job_id):
+    try:
+        if not admin_required():
+            return jsonify({"error": "Unauthorized"}), 403
+
+        job = report_jobs.find_one({"_id": to_object_id(job_id)})
+        if not job:
+            return jsonify({"error": "Report job not found"}), 404
+        if job["status"] != "done":
+            return jsonify({"error": f"Report is {job['status']}"}), 409
+        if not os.path.exists(job["path"]):
+            return jsonify({"error": "Report has expired, please generate it again"}), 410
+
+        return send_file(
+            job["path"],
+            mimetype="application/pdf" if job["format"] == "pdf" else "text/csv",
+            as_attachment=True,
+            download_name=f"{job['type']}-report.{job['format']}"
+        )
+
+    except Exception as e:
+        print(f"❌ Report download error: {str(e)}")
+        return jsonify({"error": "Failed to download report"}), 500
+
 # =====================================================
 # 🏥 HEALTH CHECK
 # =====================================================
-@app.route("/health")
+@bp.route("/health")
 def health_check():
     try:
-        # Check MongoDB connection
-        client.server_info()
+        # Check the storage backend connection
+        get_storage().ping()
         return jsonify({
             "status": "healthy",
             "database": "connected",
@@ -628,18 +3654,379 @@ def health_check():
             "error": str(e)
         }), 503
 
+# =====================================================
+# 📈 METRICS (Prometheus text format)
+# =====================================================
+# Metrics are kept per process; with several workers, scrape each one (or
+# aggregate in Prometheus by instance).
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+DOCUMENT_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000)
+
+metrics_registry = []
+
+class Metric:
+    def __init__(self, name, kind, help_text, label_names):
+        self.name = name
+        self.kind = kind
+        self.help_text = help_text
+        self.label_names = label_names
+        self.values = {}
+        self.lock = threading.Lock()
+        metrics_registry.append(self)
+
+    def label_text(self, labels, extra=""):
+        pairs = [f'{k}="{v}"' for k, v in zip(self.label_names, labels)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Counter(Metric):
+    def __init__(self, name, help_text, label_names=()):
+        super().__init__(name, "counter", help_text, label_names)
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        with self.lock:
+            return [f"{self.name}{self.label_text(k)} {v}" for k, v in self.values.items()]
+
+class Gauge(Counter):
+    def __init__(self, name, help_text, label_names=()):
+        Metric.__init__(self, name, "gauge", help_text, label_names)
+
+class Histogram(Metric):
+    def __init__(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, "histogram", help_text, label_names)
+        self.buckets = buckets
+
+    def observe(self, value, *labels):
+        with self.lock:
+            series = self.values.setdefault(labels, [[0] * len(self.buckets), 0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for labels, (counts, total, n) in self.values.items():
+                for bound, count in zip(list(self.buckets) + ["+Inf"], counts + [n]):
+                    le = 'le="%s"' % bound
+                    lines.append(f"{self.name}_bucket{self.label_text(labels, le)} {count}")
+                lines.append(f"{self.name}_sum{self.label_text(labels)} {total}")
+                lines.append(f"{self.name}_count{self.label_text(labels)} {n}")
+        return lines
+
+http_request_duration = Histogram(
+    "smartstock_http_request_duration_seconds", "HTTP request duration by route.",
+    ("method", "route", "status")
+)
+mongo_command_duration = Histogram(
+    "smartstock_mongo_command_duration_seconds", "MongoDB command latency.",
+    ("collection", "command")
+)
+mongo_documents_returned = Histogram(
+    "smartstock_mongo_documents_returned", "Documents returned per MongoDB command.",
+    ("collection", "command"), buckets=DOCUMENT_BUCKETS
+)
+mongo_command_failures = Counter(
+    "smartstock_mongo_command_failures_total", "Failed MongoDB commands.",
+    ("collection", "command")
+)
+mongo_pool_connections = Gauge(
+    "smartstock_mongo_pool_connections", "Open pooled connections per server.", ("address",)
+)
+mongo_pool_in_use = Gauge(
+    "smartstock_mongo_pool_checked_out", "Pooled connections currently checked out.", ("address",)
+)
+mongo_pool_checkout_failures = Counter(
+    "smartstock_mongo_pool_checkout_failures_total", "Failed connection checkouts.", ("address", "reason")
+)
+
+# Commands whose first argument is not a collection name
+MONGO_ADMIN_COMMANDS = {"ping", "hello", "ismaster", "isMaster", "buildInfo", "endSessions", "saslStart", "saslContinue"}
+
+def command_shape(value):
+    """Keys and operators of a command document, with every value replaced by "?"."""
+    if isinstance(value, dict):
+        return {k: command_shape(v) for k, v in value.items()}
+    if isinstance(value, list):
+        # $in lists collapse to one "?", pipelines keep one entry per distinct stage shape
+        shapes = []
+        for v in value:
+            shape = command_shape(v)
+            if shape not in shapes:
+                shapes.append(shape)
+        return shapes
+    return "?"
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    def __init__(self, slow_ms=None):
+        # Listener callbacks run outside any app context, so the threshold is passed in
+        self.slow_ms = slow_ms
+        self.in_flight = {}
+        self.lock = threading.Lock()
+
+    def started(self, event):
+        name = event.command_name
+        if name == "getMore":
+            target = event.command.get("collection", "")
+        elif name in MONGO_ADMIN_COMMANDS:
+            target = "admin"
+        else:
+            target = event.command.get(name, "")
+        target = target if isinstance(target, str) else ""
+        with self.lock:
+            self.in_flight[(event.connection_id, event.request_id)] = (target, event.command)
+
+    def pop(self, event):
+        with self.lock:
+            return self.in_flight.pop((event.connection_id, event.request_id), ("", None))
+
+    def succeeded(self, event):
+        target, command = self.pop(event)
+        seconds = event.duration_micros / 1e6
+        mongo_command_duration.observe(seconds, target, event.command_name)
+
+        cursor = event.reply.get("cursor") if isinstance(event.reply, dict) else None
+        if cursor:
+            batch = cursor.get("firstBatch", cursor.get("nextBatch", []))
+            mongo_documents_returned.observe(len(batch), target, event.command_name)
+
+        if self.slow_ms is not None and seconds * 1000 >= self.slow_ms:
+            # Shape only: filter values are customer data and must not reach the logs
+            shown = command_shape({k: v for k, v in (command or {}).items()
+                                   if k not in ("lsid", "$clusterTime", "$db", "documents", "updates")})
+            print(f"🐢 Slow query {seconds * 1000:.1f} ms on {target}.{event.command_name}: {str(shown)[:500]}")
+
+    def failed(self, event):
+        target, _ = self.pop(event)
+        mongo_command_failures.inc(target, event.command_name)
+
+class MongoPoolMetrics(monitoring.ConnectionPoolListener):
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        mongo_pool_connections.inc(str(event.address))
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        mongo_pool_connections.inc(str(event.address), amount=-1)
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        mongo_pool_checkout_failures.inc(str(event.address), str(event.reason))
+
+    def connection_checked_out(self, event):
+        mongo_pool_in_use.inc(str(event.address))
+
+    def connection_checked_in(self, event):
+        mongo_pool_in_use.inc(str(event.address), amount=-1)
+
+@bp.before_app_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@bp.after_app_request
+def record_request_duration(response):
+    started = g.get("request_started")
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        http_request_duration.observe(time.perf_counter() - started, request.method, route, str(response.status_code))
+    return response
+
+def metrics_authorized():
+    token = current_app.config["METRICS_TOKEN"]
+    if token and hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}"):
+        return True
+    return admin_required()
+
+@bp.route("/metrics")
+def metrics():
+    if not metrics_authorized():
+        return jsonify({"error": "Unauthorized"}), 403
+
+    lines = []
+    for metric in metrics_registry:
+        lines.append(f"# HELP {metric.name} {metric.help_text}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.render())
+    return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
+
+# =====================================================
+# 🗃️ STORAGE BACKENDS
+# =====================================================
+# Routes reach products, transactions and users through get_storage().
+# STORAGE_BACKEND = "mongo" (default) uses storage.MongoStorage; "sqlite" uses
+# storage.SqliteStorage, a single local file for one-store installs and tests.
+# Features built on MongoDB-only machinery (bulk and idempotent movements,
+# rollups, snapshots, archive, reports, live events, alerts, import) answer
+# 501 under SQLite, and their maintenance commands refuse to run.
+MONGO_ONLY_ENDPOINTS = {f"{bp.name}.{name}" for name in (
+    "bulk_add_transactions", "movement_summary", "inventory_as_of_route", "stream_events",
+    "reorder_suggestions", "low_stock_alert", "get_email_logs", "alert_settings",
+    "import_products_route", "submit_report", "report_status", "download_report"
+)}
+
+MONGO_ONLY_COMMANDS = (
+    "backfill-stock-levels", "rebuild-summary", "backfill-search-keys",
+    "archive-transactions", "backfill-rollups", "snapshot-inventory", "reconcile-stock",
+    "forecast-reorder", "drain-alerts", "import-products"
+)
+
+def make_storage(config):
+    if config["STORAGE_BACKEND"] == "sqlite":
+        return SqliteStorage(config["SQLITE_PATH"], ist_now)
+    if config["STORAGE_BACKEND"] != "mongo":
+        raise ValueError(f"Unknown STORAGE_BACKEND: {config['STORAGE_BACKEND']}")
+    return MongoStorage(collection, AppMongoHooks())
+
+class AppMongoHooks(MongoHooks):
+    """The summary, change feed and alert outbox behind MongoStorage's writes."""
+
+    def create_indexes(self):
+        create_indexes()
+
+    def inventory_summary(self):
+        return get_inventory_summary()
+
+    def data_version(self):
+        return data_version()
+
+    def product_query(self, spec):
+        return product_query(spec)
+
+    def transaction_query(self, spec):
+        return transaction_query(spec)
+
+    def reaches_archive(self, start):
+        return reaches_archive(start)
+
+    def product_names(self, product_ids):
+        return resolve_product_names(product_ids)
+
+    def apply_movement(self, product_id, ttype, qty, user):
+        return apply_stock_movement(product_id, ttype, qty, user)
+
+    def product_added(self, product):
+        bump_product_names()
+        queue_stock_alert(product)
+        deltas = {
+            "totalValue": product["quantity"] * product["costPrice"],
+            "productCount": 1,
+            "lowStockCount": 1 if is_low_stock(product["quantity"], product["lowStock"]) else 0
+        }
+        bump_inventory_summary(deltas["totalValue"], deltas["productCount"], deltas["lowStockCount"])
+        publish_change(
+            stock=[stock_event_item(product)],
+            stats=deltas,
+            low_stock=[low_stock_event_item(product)] if product["stockLevel"] != "ok" else None
+        )
+
+    def product_deleted(self, product):
+        bump_product_names()
+        qty = int(product.get("quantity", 0))
+        threshold = int(product.get("lowStock", 0))
+        deltas = {
+            "totalValue": -qty * float(product.get("costPrice", 0)),
+            "productCount": -1,
+            "lowStockCount": -1 if is_low_stock(qty, threshold) else 0
+        }
+        bump_inventory_summary(deltas["totalValue"], deltas["productCount"], deltas["lowStockCount"])
+        publish_change(
+            stock=[dict(stock_event_item(product), deleted=True)],
+            stats=deltas,
+            low_stock=[dict(low_stock_event_item(product), level="ok")] if deltas["lowStockCount"] else None
+        )
+
+def get_storage():
+    return app_state()["storage"]
+
+def uses_mongo():
+    return get_storage().name == "mongo"
+
+@bp.before_app_request
+def require_mongo_features():
+    if request.endpoint in MONGO_ONLY_ENDPOINTS and not uses_mongo():
+        return jsonify({"error": "Not available with the SQLite storage backend"}), 501
+
+def require_mongo_command(command):
+    callback = command.callback
+
+    @functools.wraps(callback)
+    def gated(*args, **kwargs):
+        if not uses_mongo():
+            raise click.ClickException(f"{command.name} is not available with the SQLite storage backend")
+        return callback(*args, **kwargs)
+
+    command.callback = gated
+
+for name in MONGO_ONLY_COMMANDS:
+    require_mongo_command(bp.cli.commands[name])
+
 # =====================================================
 # ❌ ERROR HANDLERS
 # =====================================================
-@app.errorhandler(404)
+@bp.app_errorhandler(404)
 def not_found(e):
     return jsonify({"error": "Resource not found"}), 404
 
-@app.errorhandler(500)
+@bp.app_errorhandler(500)
 def internal_error(e):
     print(f"❌ Internal server error: {str(e)}")
     return jsonify({"error": "Internal server error"}), 500
 
+# ================= APP FACTORY =================
+def create_app(config=None):
+    """Build the Flask app. No database work happens here; see `flask migrate`."""
+    app = Flask(__name__)
+    app.config.update(DEFAULT_CONFIG)
+    if config:
+        app.config.update(config)
+
+    # Connections are opened lazily by whichever process first needs one
+    app.extensions["smartstock"] = {
+        "mongo": {
+            "client": None,
+            "pid": None,
+            "config": {k: v for k, v in app.config.items() if k.startswith("MONGO_")},
+            "read_preferences": read_preferences(app.config)
+        },
+        "storage": make_storage(app.config),
+        "catalog_cache": {"etag": None, "body": None, "encoded": {}},
+        "events": {"subscribers": set(), "tailer_pid": None},
+        "alert_sender_pid": None
+    }
+
+    # CORS Configuration - More permissive for development
+    CORS(app, 
+         supports_credentials=True,
+         origins=["http://127.0.0.1:5000", "http://localhost:5000"],
+         allow_headers=["Content-Type", "Authorization", "Idempotency-Key"],
+         expose_headers=["X-Next-Cursor"],
+         methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"])
+
+    app.register_blueprint(bp)
+    return app
+
 # ================= RUN =================
 if __name__ == "__main__":
     print("=" * 50)
@@ -650,4 +4037,13 @@ if __name__ == "__main__":
     print(f"🔧 Debug mode: ON")
     print("=" * 50)
     
+    app = create_app()
+    try:
+        # Convenience for local runs; deployments run `flask migrate` once instead
+        with app.app_context():
+            get_storage().create_schema()
+            print(f"✅ Storage ready ({get_storage().name})")
+    except Exception as e:
+        print(f"❌ Storage connection failed: {e}")
+        print("Please ensure MongoDB is running on localhost:27017 (or set STORAGE_BACKEND=sqlite)")
     app.run(debug=True, host="127.0.0.1", port=5000)
\ No newline at end of file
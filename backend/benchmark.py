@@ -0,0 +1,422 @@
+"""
+SmartStock load-testing and benchmark harness.
+
+Seeds a dedicated database with a reproducible dataset, drives the real
+routes at fixed concurrency levels and prints throughput plus p50/p95/p99
+latency per endpoint as JSON, so runs can be compared across commits.
+
+Examples (from backend/):
+    python benchmark.py --products 100000 --transactions 10000000 --seed-only
+    python benchmark.py --concurrency 1 8 32 --output bench.json
+    python benchmark.py --compare bench.json            # fails on regressions
+    MONGO_DB=smartstock_bench flask run &                # a server on the bench database,
+    python benchmark.py --url http://127.0.0.1:5000     # then benchmark it over HTTP
+    python benchmark.py --mock --products 2000 --transactions 20000
+    python benchmark.py --sqlite bench.sqlite3          # embedded SQLite backend
+    python benchmark.py --accept-encoding gzip          # compressed responses
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from werkzeug.security import generate_password_hash
+
+import app as smartstock
+
+BENCH_USER = "bench@smartstock.local"
+BENCH_PASSWORD = "bench-password"
+SEED_BATCH = 10000
+CATEGORIES = ["Electronics", "Grocery", "Hardware", "Stationery", "Clothing", "Toys", "Pharmacy", "Garden"]
+SUPPLIERS = [f"Supplier {i}" for i in range(1, 41)]
+
+# =====================================================
+# 🌱 SEEDING
+# =====================================================
+def seed(products, transactions, seed_value, indexes=True):
+    """Replace the benchmark database contents with a deterministic dataset."""
+    rng = random.Random(seed_value)
+    storage = smartstock.get_storage()
+    storage.reset()
+    if indexes:
+        # mongomock has no capped collections and ignores indexes anyway
+        storage.create_schema()
+
+    storage.add_user({
+        "name": "Benchmark",
+        "email": BENCH_USER,
+        "password": generate_password_hash(BENCH_PASSWORD),
+        "role": "admin",
+        "createdAt": datetime.utcnow()
+    })
+
+    product_ids = []
+    for start in range(0, products, SEED_BATCH):
+        batch = []
+        for i in range(start, min(start + SEED_BATCH, products)):
+            qty = rng.randint(0, 500)
+            low = rng.randint(5, 50)
+            critical = low // 2
+            batch.append({
+                "name": f"Product {i:07d}",
+                "category": rng.choice(CATEGORIES),
+                "supplier": rng.choice(SUPPLIERS),
+                "quantity": qty,
+                "lowStock": low,
+                "criticalStock": critical,
+                "stockLevel": smartstock.stock_level(qty, low, critical),
+                "nameKey": smartstock.search_key(f"Product {i:07d}"),
+                "costPrice": round(rng.uniform(1, 500), 2),
+                "createdAt": datetime.utcnow()
+            })
+            batch[-1]["stockValue"] = qty * batch[-1]["costPrice"]
+        ids = storage.insert_products(batch)
+        product_ids.extend(zip(ids, (p["name"] for p in batch)))
+        print(f"🌱 products: {len(product_ids)}/{products}", file=sys.stderr)
+
+    # Spread the ledger over the last year, oldest first
+    start_date = datetime(2025, 1, 1)
+    step = timedelta(days=365) / max(transactions, 1)
+    for start in range(0, transactions, SEED_BATCH):
+        batch = []
+        for i in range(start, min(start + SEED_BATCH, transactions)):
+            oid, name = rng.choice(product_ids)
+            batch.append({
+                "product_id": oid,
+                "productName": name,
+                "type": "IN" if rng.random() < 0.4 else "OUT",
+                "quantity": rng.randint(1, 20),
+                "date": start_date + step * i,
+                "user": BENCH_USER
+            })
+        storage.insert_transactions(batch)
+        print(f"🌱 transactions: {min(start + SEED_BATCH, transactions)}/{transactions}", file=sys.stderr)
+
+    if smartstock.uses_mongo():
+        smartstock.rebuild_inventory_summary()
+    return [str(oid) for oid, _ in product_ids]
+
+# =====================================================
+# 🌐 CLIENTS
+# =====================================================
+class InProcessClient:
+    """Drives the Flask app through its test client: no network in the way."""
+
+    def __init__(self, flask_app, headers=None):
+        self.client = flask_app.test_client()
+        self.headers = headers or {}
+
+    def request(self, method, path, json_body=None, form=None):
+        resp = self.client.open(path, method=method, json=json_body, data=form, headers=self.headers, buffered=False)
+        size = sum(len(chunk) for chunk in resp.response)
+        resp.close()
+        return resp.status_code, size
+
+class HttpClient:
+    """Drives a running server over HTTP with its own cookie jar."""
+
+    def __init__(self, base_url, headers=None):
+        self.base_url = base_url.rstrip("/")
+        self.headers = headers or {}
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar())
+        )
+
+    def request(self, method, path, json_body=None, form=None):
+        data = None
+        headers = dict(self.headers)
+        if json_body is not None:
+            data = json.dumps(json_body).encode()
+            headers["Content-Type"] = "application/json"
+        elif form is not None:
+            data = urllib.parse.urlencode(form).encode()
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        req = urllib.request.Request(self.base_url + path, data=data, headers=headers, method=method)
+        try:
+            with self.opener.open(req) as resp:
+                return resp.status, len(resp.read())
+        except urllib.error.HTTPError as e:
+            return e.code, len(e.read())
+
+    def get_json(self, path):
+        req = urllib.request.Request(self.base_url + path, headers={"Accept": "application/json"})
+        with self.opener.open(req) as resp:
+            return json.loads(resp.read())
+
+def login(client):
+    status, _ = client.request("POST", "/login", json_body={"email": BENCH_USER, "password": BENCH_PASSWORD})
+    if status != 200:
+        raise RuntimeError(f"Benchmark login failed with status {status}")
+
+def check_server_dataset(base_url, storage):
+    """
+    Seeding writes to the local bench database, so a --url server must be
+    running on that same database. Its bench login and catalog totals must
+    match what was seeded; returns an error message, or None.
+    """
+    client = HttpClient(base_url)
+    try:
+        login(client)
+        served = client.get_json("/api/stats")
+    except (RuntimeError, OSError, ValueError) as e:
+        return f"cannot log in to {base_url} as the bench user ({e})"
+    seeded = storage.inventory_summary()
+    if (served.get("totalProducts") != seeded["productCount"]
+            or served.get("inventoryValue") != round(seeded["totalValue"], 2)):
+        return (f"{base_url} serves {served.get('totalProducts')} products, the bench database "
+                f"has {seeded['productCount']}")
+    return None
+
+# =====================================================
+# 🏁 SCENARIOS
+# =====================================================
+def scenarios(product_ids):
+    """Endpoint name -> function(client, rng) returning (status, bytes)."""
+    def products_list(client, rng):
+        return client.request("GET", "/api/products")
+
+    def products_columns(client, rng):
+        return client.request("GET", "/api/products?format=columns")
+
+    def products_page(client, rng):
+        sort = rng.choice(["name", "-quantity", "-value"])
+        if rng.random() < 0.5:
+            return client.request("GET", f"/api/products?limit=50&sort={sort}")
+        category = urllib.parse.quote_plus(rng.choice(CATEGORIES))
+        return client.request("GET", f"/api/products?limit=50&sort={sort}&category={category}")
+
+    def search(client, rng):
+        # Typing a name prefix, or a word from category / supplier
+        if rng.random() < 0.5:
+            return client.request("GET", f"/api/products/search?q=product+{rng.randint(0, 999):03d}")
+        return client.request("GET", "/api/products/search?q=" + urllib.parse.quote_plus(rng.choice(CATEGORIES + SUPPLIERS)))
+
+    def transactions_page(client, rng):
+        if rng.random() < 0.5:
+            return client.request("GET", "/api/transactions")
+        return client.request("GET", f"/api/transactions?product_id={rng.choice(product_ids)}")
+
+    def add_transaction(client, rng):
+        # Net positive so the run never drains stock and measures rejections instead
+        ttype = "IN" if rng.random() < 0.6 else "OUT"
+        return client.request("POST", "/add_transaction", form={
+            "product_id": rng.choice(product_ids),
+            "transaction_type": ttype,
+            "quantity": str(rng.randint(1, 3))
+        })
+
+    def stats(client, rng):
+        return client.request("GET", "/api/stats")
+
+    def export_csv(client, rng):
+        return client.request("GET", "/export/inventory-csv")
+
+    def login_route(client, rng):
+        return client.request("POST", "/login", json_body={"email": BENCH_USER, "password": BENCH_PASSWORD})
+
+    return {
+        "GET /api/products": products_list,
+        "GET /api/products?format=columns": products_columns,
+        "GET /api/products?limit=50": products_page,
+        "GET /api/products/search": search,
+        "GET /api/transactions": transactions_page,
+        "POST /add_transaction": add_transaction,
+        "GET /api/stats": stats,
+        "GET /export/inventory-csv": export_csv,
+        "POST /login": login_route
+    }
+
+def percentile(sorted_values, pct):
+    # Nearest-rank percentile; stable across runs for the same sample count
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(pct / 100 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+def run_scenario(make_client, fn, concurrency, requests, warmup, seed_value):
+    clients = []
+    for _ in range(concurrency):
+        client = make_client()
+        login(client)
+        clients.append(client)
+
+    warm_rng = random.Random(seed_value)
+    for i in range(warmup):
+        fn(clients[i % concurrency], warm_rng)
+
+    latencies = []
+    errors = 0
+    total_bytes = 0
+    lock = threading.Lock()
+
+    def worker(index):
+        nonlocal errors, total_bytes
+        rng = random.Random(seed_value * 1000 + index)
+        client = clients[index]
+        local = []
+        local_errors = 0
+        local_bytes = 0
+        for _ in range(index, requests, concurrency):
+            started = time.perf_counter()
+            status, size = fn(client, rng)
+            local.append((time.perf_counter() - started) * 1000)
+            local_bytes += size
+            if status >= 400:
+                local_errors += 1
+        with lock:
+            latencies.extend(local)
+            errors += local_errors
+            total_bytes += local_bytes
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "bytes_per_request": round(total_bytes / len(latencies)) if latencies else 0
+    }
+
+# =====================================================
+# 📊 REPORTING
+# =====================================================
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+def compare(baseline, current, tolerance):
+    """Return human-readable regressions of p95 latency or throughput beyond tolerance."""
+    regressions = []
+    for level, endpoints in current["results"].items():
+        for endpoint, now in endpoints.items():
+            before = baseline.get("results", {}).get(level, {}).get(endpoint)
+            if not before:
+                continue
+            if before["p95_ms"] and now["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+                regressions.append(f"{endpoint} @ c={level}: p95 {before['p95_ms']} -> {now['p95_ms']} ms")
+            if before["throughput_rps"] and now["throughput_rps"] < before["throughput_rps"] * (1 - tolerance):
+                regressions.append(f"{endpoint} @ c={level}: {before['throughput_rps']} -> {now['throughput_rps']} req/s")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="SmartStock load-testing and benchmark suite")
+    parser.add_argument("--mongo-uri", default=os.environ.get("MONGO_URI", "mongodb://localhost:27017"))
+    parser.add_argument("--db", default="smartstock_bench", help="Database to seed and benchmark (it is wiped!)")
+    parser.add_argument("--mock", action="store_true", help="Use an in-process mongomock stand-in instead of MongoDB")
+    parser.add_argument("--sqlite", metavar="PATH", help="Use the SQLite storage backend with this file (it is wiped!)")
+    parser.add_argument("--url", help="Benchmark a running server instead of the in-process app")
+    parser.add_argument("--accept-encoding", help="Send this Accept-Encoding (e.g. gzip, br); bytes are measured on the wire")
+    parser.add_argument("--products", type=int, default=10000)
+    parser.add_argument("--transactions", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--reuse", action="store_true", help="Keep the existing dataset instead of reseeding")
+    parser.add_argument("--seed-only", action="store_true")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=500, help="Measured requests per endpoint and level")
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--endpoints", nargs="+", help="Only run endpoints containing these substrings")
+    parser.add_argument("--output", help="Write the JSON result to this file as well as stdout")
+    parser.add_argument("--compare", help="Baseline JSON; exit 1 if any endpoint regressed")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Allowed relative regression")
+    args = parser.parse_args()
+    if args.url and args.mock:
+        parser.error("--mock seeds an in-process stand-in that a --url server cannot see")
+
+    config = {"MONGO_URI": args.mongo_uri, "MONGO_DB": args.db, "TESTING": True}
+    if args.sqlite:
+        config.update(STORAGE_BACKEND="sqlite", SQLITE_PATH=args.sqlite)
+    flask_app = smartstock.create_app(config)
+    # Seeding and the dataset counts go through the app's storage
+    flask_app.app_context().push()
+    storage = smartstock.get_storage()
+    if args.mock:
+        try:
+            import mongomock
+        except ImportError:
+            parser.error("--mock needs mongomock (pip install mongomock)")
+        # Pin the app's per-process client to the stand-in
+        state = flask_app.extensions["smartstock"]["mongo"]
+        state["client"] = mongomock.MongoClient()
+        state["pid"] = os.getpid()
+
+    if args.reuse:
+        product_ids = [str(p["_id"]) for p in storage.list_products({"_id": 1})]
+    else:
+        product_ids = seed(args.products, args.transactions, args.seed, indexes=not args.mock)
+    if args.seed_only:
+        return
+    if args.url:
+        error = check_server_dataset(args.url, storage)
+        if error:
+            parser.error(f"{error}; start the server with the same MONGO_DB / SQLITE_PATH as --db / --sqlite")
+
+    headers = {"Accept-Encoding": args.accept_encoding} if args.accept_encoding else {}
+    if args.url:
+        make_client = lambda: HttpClient(args.url, headers)
+    else:
+        make_client = lambda: InProcessClient(flask_app, headers)
+
+    selected = {
+        name: fn for name, fn in scenarios(product_ids).items()
+        if not args.endpoints or any(e in name for e in args.endpoints)
+    }
+
+    result = {
+        "commit": git_commit(),
+        "timestamp": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "target": args.url or ("in-process/mongomock" if args.mock else f"in-process/{storage.name}"),
+        "dataset": dict(storage.counts(), seed=args.seed),
+        "accept_encoding": args.accept_encoding,
+        "requests_per_endpoint": args.requests,
+        "results": {}
+    }
+
+    for level in args.concurrency:
+        result["results"][str(level)] = {}
+        for name, fn in selected.items():
+            stats = run_scenario(make_client, fn, level, args.requests, args.warmup, args.seed)
+            result["results"][str(level)][name] = stats
+            print(f"⏱️  c={level:<3} {name:<28} {stats['throughput_rps']:>9} req/s  "
+                  f"p50 {stats['p50_ms']:>8} ms  p95 {stats['p95_ms']:>8} ms  p99 {stats['p99_ms']:>8} ms",
+                  file=sys.stderr)
+
+    output = json.dumps(result, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), result, args.tolerance)
+        for line in regressions:
+            print(f"❌ Regression: {line}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print("✅ No regressions against baseline", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
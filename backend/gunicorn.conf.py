@@ -0,0 +1,14 @@
+"""
+Production server settings; `cd backend && gunicorn` picks this file up.
+
+gevent workers serve each request, and each open /api/events stream, as a
+greenlet, so hundreds of idle dashboards do not hold an OS thread each.
+"""
+import os
+
+wsgi_app = "app:create_app()"
+bind = os.environ.get("SMARTSTOCK_BIND", "127.0.0.1:5000")
+worker_class = "gevent"
+workers = int(os.environ.get("WEB_CONCURRENCY", 4))
+# Live streams (up to app.EVENT_STREAMS_GEVENT per worker) plus ordinary requests
+worker_connections = 1200
@@ -0,0 +1,813 @@
+"""
+SmartStock storage backends for products, transactions and users.
+
+Routes in app.py reach these three through get_storage(), which returns
+either MongoStorage (the default) or SqliteStorage below. SqliteStorage
+keeps everything in one local file, so a single-store deployment (or a test
+run) needs no database server.
+
+Documents are exchanged in the MongoDB shape the rest of the app already
+uses ("_id", "lowStock", "costPrice", ...); only ids differ (ObjectId vs int),
+which is why callers parse ids through Storage.parse_id().
+"""
+import abc
+import heapq
+import itertools
+import os
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+# =====================================================
+# 🧩 INTERFACE
+# =====================================================
+class Storage(abc.ABC):
+    """Operations the routes need; every backend implements all of them."""
+
+    name = None
+
+    # ---- lifecycle ----
+    @abc.abstractmethod
+    def create_schema(self):
+        """Create tables / collections and indexes (idempotent)."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def reset(self):
+        """Delete all products, transactions and users (benchmark seeding)."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def ping(self):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def parse_id(self, value):
+        """Turn a client-supplied id into the backend's id type, or None."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def data_version(self):
+        """Stamp that changes whenever a product or stock write lands."""
+        raise NotImplementedError
+
+    # ---- users ----
+    @abc.abstractmethod
+    def find_user(self, email):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def add_user(self, user):
+        """Insert a user document. Returns False if the email is taken."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def list_users(self):
+        """Every user, without the password hash."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def set_user_role(self, email, role):
+        """Returns False if there is no such user."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def delete_user(self, email):
+        """Returns False if there is no such user."""
+        raise NotImplementedError
+
+    # ---- products ----
+    @abc.abstractmethod
+    def list_products(self, fields=None):
+        """Every product, in no particular order; fields optionally limits what is read."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def find_products(self, spec, fields):
+        """
+        Products matching spec (see app.build_product_query): category,
+        supplier and low filters, sort = (stored field, 1 | -1), after =
+        (sort value, id) for keyset pages and an optional limit. fields lists
+        the stored fields the caller will read.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def search_products(self, q, limit):
+        """Up to limit (product, match, score) tuples: name-prefix hits first, then text hits."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def low_stock_products(self):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def add_product(self, product):
+        """Insert a fully built product document. Returns its id."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def insert_products(self, docs):
+        """Bulk load product documents without side effects. Returns their ids."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def delete_product(self, product_id):
+        """Delete a product. Returns the deleted document, or None."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def inventory_summary(self):
+        """Dict with totalValue, productCount, lowStockCount and criticalCount."""
+        raise NotImplementedError
+
+    # ---- transactions ----
+    @abc.abstractmethod
+    def apply_movement(self, product_id, ttype, qty, user):
+        """Apply one IN/OUT movement and record it. Returns (ledger_row, error, status)."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def insert_transactions(self, rows):
+        """Bulk load ledger rows without touching stock (seeding, migration)."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def find_transactions(self, spec, limit):
+        """
+        Newest-first page of ledger rows matching spec (see
+        app.parse_transaction_filters), with productName resolved to the
+        current product name ("Unknown Product" once it is deleted).
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def iter_transactions(self, spec):
+        """All matching ledger rows, oldest first, streamed."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def movements_today(self, day_start):
+        """Dict with inCount, outCount, inQty and outQty since day_start."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def counts(self):
+        """Dict with the number of products and transactions."""
+        raise NotImplementedError
+
+# =====================================================
+# 🍃 MONGODB
+# =====================================================
+# The default backend. Storage here only reads and writes collections; what a
+# write means beyond that (the materialized summary, the change feed, the
+# alert outbox) and the filters built from the app's stock-level rules stay in
+# app.py, which passes them in as a MongoHooks object.
+
+# Ledger fields a history page reads
+TRANSACTION_PAGE_FIELDS = {"product_id": 1, "productName": 1, "type": 1, "quantity": 1, "date": 1, "user": 1}
+# Ledger fields the CSV export and transaction report read
+TRANSACTION_EXPORT_FIELDS = {"date": 1, "productName": 1, "type": 1, "quantity": 1, "user": 1}
+# Product fields a search result reads
+SEARCH_FIELDS = {"name": 1, "quantity": 1, "lowStock": 1, "category": 1, "supplier": 1, "costPrice": 1}
+# Documents per round trip when streaming a whole collection
+EXPORT_BATCH_SIZE = 1000
+MONGO_COLLECTIONS = ("products", "transactions", "users", "stats", "daily_rollups", "events")
+
+def ledger_key(row):
+    return row["date"], row["_id"]
+
+def merge_ledger(hot, cold, newest_first=False):
+    """Merge two (date, _id)-ordered row streams; a row copied but not yet deleted appears once."""
+    last_id = None
+    for row in heapq.merge(hot, cold, key=ledger_key, reverse=newest_first):
+        if row["_id"] != last_id:
+            yield row
+        last_id = row["_id"]
+
+class MongoHooks(abc.ABC):
+    """What MongoStorage needs from the app beyond its collections."""
+
+    @abc.abstractmethod
+    def create_indexes(self):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def inventory_summary(self):
+        """The materialized summary document (totalValue, productCount, lowStockCount)."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def data_version(self):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def product_query(self, spec):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def transaction_query(self, spec):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def reaches_archive(self, start):
+        """The archive boundary if a range starting at start reaches it, else None."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def product_names(self, product_ids):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def apply_movement(self, product_id, ttype, qty, user):
+        """Guarded stock update, ledger row and rollups; see Storage.apply_movement."""
+        raise NotImplementedError
+
+    # ---- side effects ----
+    @abc.abstractmethod
+    def product_added(self, product):
+        """Called after a product is inserted."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def product_deleted(self, product):
+        """Called with the removed document after a product is deleted."""
+        raise NotImplementedError
+
+class MongoStorage(Storage):
+    name = "mongo"
+
+    def __init__(self, collection, hooks):
+        # collection(name) returns the pymongo collection for the current app
+        self.collection = collection
+        self.hooks = hooks
+        self.products = collection("products")
+        self.transactions = collection("transactions")
+        self.transactions_archive = collection("transactions_archive")
+        self.users = collection("users")
+        self.daily_rollups = collection("daily_rollups")
+
+    def create_schema(self):
+        self.hooks.create_indexes()
+
+    def reset(self):
+        for name in MONGO_COLLECTIONS:
+            self.collection(name).drop()
+
+    def ping(self):
+        self.products.database.client.admin.command("ping")
+
+    def parse_id(self, value):
+        try:
+            return ObjectId(value)
+        except Exception:
+            return None
+
+    def data_version(self):
+        return self.hooks.data_version()
+
+    # ---- users ----
+    def find_user(self, email):
+        return self.users.find_one({"email": email})
+
+    def add_user(self, user):
+        try:
+            self.users.insert_one(user)
+        except DuplicateKeyError:
+            return False
+        return True
+
+    def list_users(self):
+        return self.users.find({}, {"password": 0})
+
+    def set_user_role(self, email, role):
+        return self.users.update_one({"email": email}, {"$set": {"role": role}}).matched_count > 0
+
+    def delete_user(self, email):
+        return self.users.delete_one({"email": email}).deleted_count > 0
+
+    # ---- products ----
+    def list_products(self, fields=None):
+        return self.products.find({}, fields).batch_size(EXPORT_BATCH_SIZE)
+
+    def find_products(self, spec, fields):
+        sort_field, direction = spec["sort"]
+        projection = dict.fromkeys(fields, 1)
+        projection[sort_field] = 1
+        cursor = self.products.find(self.hooks.product_query(spec), projection).sort([(sort_field, direction), ("_id", direction)])
+        if spec.get("limit"):
+            cursor = cursor.limit(spec["limit"])
+        return list(cursor)
+
+    def search_products(self, q, limit):
+        results = []
+        seen = set()
+        prefix = {"nameKey": {"$regex": "^" + re.escape(q)}}
+        for p in self.products.find(prefix, SEARCH_FIELDS).sort("nameKey", 1).limit(limit):
+            seen.add(p["_id"])
+            results.append((p, "prefix", None))
+
+        if len(results) < limit:
+            cursor = (
+                self.products.find({"$text": {"$search": q}}, dict(SEARCH_FIELDS, score={"$meta": "textScore"}))
+                .sort([("score", {"$meta": "textScore"})])
+                .limit(limit)
+            )
+            for p in cursor:
+                if p["_id"] in seen:
+                    continue
+                results.append((p, "text", p["score"]))
+                if len(results) == limit:
+                    break
+        return results
+
+    def low_stock_products(self):
+        return self.products.find(
+            self.hooks.product_query({"low": True}),
+            {"name": 1, "quantity": 1, "lowStock": 1, "stockLevel": 1}
+        )
+
+    def add_product(self, product):
+        self.products.insert_one(product)
+        self.hooks.product_added(product)
+        return product["_id"]
+
+    def insert_products(self, docs):
+        return self.products.insert_many(docs).inserted_ids
+
+    def delete_product(self, product_id):
+        product = self.products.find_one_and_delete({"_id": product_id})
+        if product:
+            self.hooks.product_deleted(product)
+        return product
+
+    def inventory_summary(self):
+        summary = self.hooks.inventory_summary()
+        return {
+            "totalValue": summary.get("totalValue", 0),
+            "productCount": summary.get("productCount", 0),
+            "lowStockCount": summary.get("lowStockCount", 0),
+            "criticalCount": self.products.count_documents({"stockLevel": "critical"})
+        }
+
+    # ---- transactions ----
+    def apply_movement(self, product_id, ttype, qty, user):
+        return self.hooks.apply_movement(product_id, ttype, qty, user)
+
+    def insert_transactions(self, rows):
+        self.transactions.insert_many(rows)
+
+    def find_transactions(self, spec, limit):
+        query = self.hooks.transaction_query(spec)
+        rows = list(
+            self.transactions.find(query, TRANSACTION_PAGE_FIELDS)
+            .sort([("date", -1), ("_id", -1)])
+            .limit(limit)
+        )
+        # Archived rows are older than the boundary: a full page that ends after
+        # it cannot contain any, otherwise merge in the archive's newest matches
+        boundary = self.hooks.reaches_archive(spec.get("from"))
+        if boundary is not None and (len(rows) < limit or rows[-1]["date"] < boundary):
+            cold = list(
+                self.transactions_archive.find(query, TRANSACTION_PAGE_FIELDS)
+                .sort([("date", -1), ("_id", -1)])
+                .limit(limit)
+            )
+            rows = list(itertools.islice(merge_ledger(rows, cold, newest_first=True), limit))
+
+        # Resolve all product names in a single batched lookup
+        product_ids = {self.parse_id(t["product_id"]) for t in rows if "product_id" in t}
+        product_ids.discard(None)
+        names = self.hooks.product_names(product_ids)
+        for t in rows:
+            if "product_id" in t:
+                t["productName"] = names.get(self.parse_id(t["product_id"]), "Unknown Product")
+        return rows
+
+    def ledger_rows(self, query, start, projection=None):
+        """Matching ledger rows in (date, _id) order, archived rows included when the range reaches them."""
+        sort = [("date", 1), ("_id", 1)]
+        hot = self.transactions.find(query, projection).sort(sort).batch_size(EXPORT_BATCH_SIZE)
+        if self.hooks.reaches_archive(start) is None:
+            return hot
+        cold = self.transactions_archive.find(query, projection).sort(sort).batch_size(EXPORT_BATCH_SIZE)
+        return merge_ledger(hot, cold)
+
+    def iter_transactions(self, spec):
+        return self.ledger_rows(self.hooks.transaction_query(spec), spec.get("from"), TRANSACTION_EXPORT_FIELDS)
+
+    def movements_today(self, day_start):
+        today = self.daily_rollups.find_one({"day": day_start, "product_id": None}) or {}
+        return {f: today.get(f, 0) for f in ("inCount", "outCount", "inQty", "outQty")}
+
+    def counts(self):
+        return {"products": self.products.estimated_document_count(),
+                "transactions": self.transactions.estimated_document_count()}
+
+
+# =====================================================
+# 🪶 SQLITE
+# =====================================================
+# One connection per thread (and per process: connections must not cross a
+# fork), in WAL mode so readers never wait for the writer. Every statement is
+# a constant parameterized string, so sqlite3's per-connection statement cache
+# prepares each one once. Stock movements run in BEGIN IMMEDIATE transactions:
+# the guarded update and its ledger row commit or roll back together.
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    email TEXT NOT NULL UNIQUE,
+    name TEXT NOT NULL DEFAULT '',
+    password TEXT NOT NULL,
+    role TEXT NOT NULL DEFAULT 'employee',
+    created_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS products (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    name_key TEXT NOT NULL,
+    sku TEXT UNIQUE,
+    category TEXT NOT NULL DEFAULT '',
+    supplier TEXT NOT NULL DEFAULT '',
+    quantity INTEGER NOT NULL DEFAULT 0,
+    opening_quantity INTEGER NOT NULL DEFAULT 0,
+    low_stock INTEGER NOT NULL DEFAULT 0,
+    critical_stock INTEGER NOT NULL DEFAULT 0,
+    cost_price REAL NOT NULL DEFAULT 0,
+    stock_level TEXT NOT NULL DEFAULT 'ok',
+    stock_value REAL NOT NULL DEFAULT 0,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS products_name ON products (name, id);
+CREATE INDEX IF NOT EXISTS products_quantity ON products (quantity, id);
+CREATE INDEX IF NOT EXISTS products_value ON products (stock_value, id);
+CREATE INDEX IF NOT EXISTS products_category ON products (category, name, id);
+CREATE INDEX IF NOT EXISTS products_supplier ON products (supplier, name, id);
+CREATE INDEX IF NOT EXISTS products_level ON products (stock_level, name, id);
+CREATE INDEX IF NOT EXISTS products_name_key ON products (name_key);
+
+-- Ledger rows outlive their product, as in MongoDB: no foreign key
+CREATE TABLE IF NOT EXISTS transactions (
+    id INTEGER PRIMARY KEY,
+    product_id INTEGER NOT NULL,
+    product_name TEXT NOT NULL,
+    type TEXT NOT NULL CHECK (type IN ('IN', 'OUT')),
+    quantity INTEGER NOT NULL,
+    date TEXT NOT NULL,
+    user TEXT
+);
+CREATE INDEX IF NOT EXISTS transactions_date ON transactions (date, id);
+CREATE INDEX IF NOT EXISTS transactions_product ON transactions (product_id, date, id);
+CREATE INDEX IF NOT EXISTS transactions_type ON transactions (type, date, id);
+CREATE INDEX IF NOT EXISTS transactions_user ON transactions (user, date, id);
+
+-- Full-text search over name, category and supplier, kept in step by triggers
+CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+    name, category, supplier, content='products', content_rowid='id'
+);
+CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products BEGIN
+    INSERT INTO products_fts (rowid, name, category, supplier)
+    VALUES (new.id, new.name, new.category, new.supplier);
+END;
+CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products BEGIN
+    INSERT INTO products_fts (products_fts, rowid, name, category, supplier)
+    VALUES ('delete', old.id, old.name, old.category, old.supplier);
+END;
+CREATE TRIGGER IF NOT EXISTS products_fts_update AFTER UPDATE OF name, category, supplier ON products BEGIN
+    INSERT INTO products_fts (products_fts, rowid, name, category, supplier)
+    VALUES ('delete', old.id, old.name, old.category, old.supplier);
+    INSERT INTO products_fts (rowid, name, category, supplier)
+    VALUES (new.id, new.name, new.category, new.supplier);
+END;
+
+-- Bumped in the same transaction as every product or stock write
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('version', 0);
+"""
+
+# Document field -> column, for products
+PRODUCT_COLUMNS = {
+    "_id": "id", "name": "name", "nameKey": "name_key", "sku": "sku",
+    "category": "category", "supplier": "supplier", "quantity": "quantity",
+    "openingQuantity": "opening_quantity", "lowStock": "low_stock",
+    "criticalStock": "critical_stock", "costPrice": "cost_price",
+    "stockLevel": "stock_level", "stockValue": "stock_value", "createdAt": "created_at"
+}
+PRODUCT_INSERT_FIELDS = [f for f in PRODUCT_COLUMNS if f != "_id"]
+PRODUCT_INSERT_SQL = "INSERT INTO products ({}) VALUES ({})".format(
+    ", ".join(PRODUCT_COLUMNS[f] for f in PRODUCT_INSERT_FIELDS),
+    ", ".join(f":{f}" for f in PRODUCT_INSERT_FIELDS)
+)
+
+# Same rules as app.stock_level(), evaluated on the quantity after the move
+MOVE_SQL = """
+UPDATE products SET
+    quantity = quantity + :delta,
+    stock_value = (quantity + :delta) * cost_price,
+    stock_level = CASE
+        WHEN low_stock <= 0 THEN 'ok'
+        WHEN quantity + :delta <= critical_stock THEN 'critical'
+        WHEN quantity + :delta <= low_stock THEN 'low'
+        ELSE 'ok'
+    END
+WHERE id = :id AND quantity + :delta >= 0
+RETURNING name
+"""
+
+TRANSACTION_INSERT_SQL = """
+INSERT INTO transactions (product_id, product_name, type, quantity, date, user)
+VALUES (:product_id, :productName, :type, :quantity, :date, :user)
+"""
+
+TRANSACTION_SELECT = """
+SELECT t.id, t.product_id, COALESCE(p.name, 'Unknown Product') AS product_name,
+       t.type, t.quantity, t.date, t.user
+FROM transactions t LEFT JOIN products p ON p.id = t.product_id
+"""
+
+def to_text(value):
+    # Fixed-width ISO text sorts like the datetime it stands for
+    return value.strftime("%Y-%m-%dT%H:%M:%S.%f") if isinstance(value, datetime) else value
+
+def from_text(value):
+    return datetime.fromisoformat(value) if value else None
+
+def product_doc(row):
+    # Rows may carry only some columns (see SqliteStorage.list_products)
+    present = set(row.keys())
+    doc = {field: row[column] for field, column in PRODUCT_COLUMNS.items() if column in present}
+    if "createdAt" in doc:
+        doc["createdAt"] = from_text(doc["createdAt"])
+    return doc
+
+def user_doc(row):
+    return {"_id": row["id"], "email": row["email"], "name": row["name"],
+            "password": row["password"], "role": row["role"],
+            "createdAt": from_text(row["created_at"])}
+
+def transaction_doc(row):
+    return {"_id": row["id"], "product_id": row["product_id"], "productName": row["product_name"],
+            "type": row["type"], "quantity": row["quantity"], "date": from_text(row["date"]),
+            "user": row["user"]}
+
+def fts_query(q):
+    # Each word quoted so FTS5 operators typed by users stay literal; any word may match
+    return " OR ".join('"{}"'.format(word.replace('"', '""')) for word in q.split())
+
+class SqliteStorage(Storage):
+    name = "sqlite"
+
+    def __init__(self, path, clock, busy_timeout_ms=5000):
+        self.path = path
+        # Ledger times come from the app's clock (naive IST, like MongoDB's ledger)
+        self.clock = clock
+        self.busy_timeout_ms = busy_timeout_ms
+        self.local = threading.local()
+
+    # ---- connections ----
+    def conn(self):
+        local = self.local
+        if getattr(local, "pid", None) != os.getpid():
+            # isolation_level=None: statements autocommit unless inside write()
+            conn = sqlite3.connect(self.path, isolation_level=None, cached_statements=256)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout_ms)}")
+            local.conn, local.pid = conn, os.getpid()
+        return local.conn
+
+    @contextmanager
+    def write(self):
+        """One IMMEDIATE transaction that bumps the data version if it changed anything."""
+        conn = self.conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            before = conn.total_changes
+            yield conn
+            if conn.total_changes != before:
+                conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    # ---- lifecycle ----
+    def create_schema(self):
+        self.conn().executescript(SQLITE_SCHEMA)
+
+    def reset(self):
+        self.create_schema()
+        with self.write() as conn:
+            for table in ("transactions", "products", "users"):
+                conn.execute(f"DELETE FROM {table}")
+
+    def ping(self):
+        self.conn().execute("SELECT 1").fetchone()
+
+    def parse_id(self, value):
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
+
+    def data_version(self):
+        row = self.conn().execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        return f"sqlite.{row[0] if row else 0}"
+
+    # ---- users ----
+    def find_user(self, email):
+        row = self.conn().execute("SELECT * FROM users WHERE email = ?", (email,)).fetchone()
+        return user_doc(row) if row else None
+
+    def add_user(self, user):
+        try:
+            self.conn().execute(
+                "INSERT INTO users (email, name, password, role, created_at) VALUES (?, ?, ?, ?, ?)",
+                (user["email"], user.get("name", ""), user["password"], user.get("role", "employee"),
+                 to_text(user.get("createdAt") or datetime.utcnow()))
+            )
+        except sqlite3.IntegrityError:
+            return False
+        return True
+
+    def list_users(self):
+        return [user_doc(r) for r in self.conn().execute(
+            "SELECT id, email, name, NULL AS password, role, created_at FROM users ORDER BY id"
+        )]
+
+    def set_user_role(self, email, role):
+        cur = self.conn().execute("UPDATE users SET role = ? WHERE email = ?", (role, email))
+        return cur.rowcount > 0
+
+    def delete_user(self, email):
+        return self.conn().execute("DELETE FROM users WHERE email = ?", (email,)).rowcount > 0
+
+    # ---- products ----
+    def list_products(self, fields=None):
+        columns = "*"
+        if fields is not None:
+            columns = ", ".join(["id"] + [PRODUCT_COLUMNS[f] for f in fields if f in PRODUCT_COLUMNS and f != "_id"])
+        return (product_doc(r) for r in self.conn().execute(f"SELECT {columns} FROM products"))
+
+    def find_products(self, spec, fields):
+        where, params = [], {}
+        for f in ("category", "supplier"):
+            if spec.get(f):
+                where.append(f"{f} = :{f}")
+                params[f] = spec[f]
+        if spec.get("low"):
+            where.append("stock_level IN ('low', 'critical')")
+
+        sort_field, direction = spec["sort"]
+        column = PRODUCT_COLUMNS[sort_field]
+        order = "DESC" if direction < 0 else "ASC"
+        if spec.get("after"):
+            where.append(f"({column}, id) {'<' if direction < 0 else '>'} (:after_value, :after_id)")
+            params["after_value"], params["after_id"] = spec["after"]
+
+        sql = "SELECT * FROM products"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += f" ORDER BY {column} {order}, id {order}"
+        if spec.get("limit"):
+            sql += " LIMIT :limit"
+            params["limit"] = spec["limit"]
+        return [product_doc(r) for r in self.conn().execute(sql, params)]
+
+    def search_products(self, q, limit):
+        conn = self.conn()
+        # Prefix range on the lower-cased name: an index range scan
+        results = [(product_doc(r), "prefix", None) for r in conn.execute(
+            "SELECT * FROM products WHERE name_key >= ? AND name_key < ? ORDER BY name_key LIMIT ?",
+            (q, q + "\U0010ffff", limit)
+        )]
+        if len(results) < limit:
+            seen = {doc["_id"] for doc, _, _ in results}
+            rows = conn.execute(
+                "SELECT p.*, -bm25(products_fts, 10.0, 3.0, 2.0) AS score "
+                "FROM products_fts JOIN products p ON p.id = products_fts.rowid "
+                "WHERE products_fts MATCH ? ORDER BY score DESC LIMIT ?",
+                (fts_query(q), limit)
+            )
+            for r in rows:
+                if r["id"] not in seen and len(results) < limit:
+                    results.append((product_doc(r), "text", r["score"]))
+        return results
+
+    def low_stock_products(self):
+        return [product_doc(r) for r in self.conn().execute(
+            "SELECT * FROM products WHERE stock_level IN ('low', 'critical') ORDER BY stock_level, name"
+        )]
+
+    def add_product(self, product):
+        with self.write() as conn:
+            return conn.execute(PRODUCT_INSERT_SQL, self.product_params(product)).lastrowid
+
+    def insert_products(self, docs):
+        ids = []
+        with self.write() as conn:
+            for doc in docs:
+                ids.append(conn.execute(PRODUCT_INSERT_SQL, self.product_params(doc)).lastrowid)
+        return ids
+
+    def product_params(self, product):
+        params = {f: product.get(f) for f in PRODUCT_INSERT_FIELDS}
+        params["nameKey"] = params["nameKey"] or (product.get("name") or "").lower()
+        params["createdAt"] = to_text(params["createdAt"] or datetime.utcnow())
+        for f in ("category", "supplier"):
+            params[f] = params[f] or ""
+        for f in ("quantity", "openingQuantity", "lowStock", "criticalStock", "costPrice", "stockValue"):
+            params[f] = params[f] or 0
+        params["stockLevel"] = params["stockLevel"] or "ok"
+        return params
+
+    def delete_product(self, product_id):
+        with self.write() as conn:
+            row = conn.execute("DELETE FROM products WHERE id = ? RETURNING *", (product_id,)).fetchone()
+        return product_doc(row) if row else None
+
+    def inventory_summary(self):
+        row = self.conn().execute(
+            "SELECT COALESCE(SUM(stock_value), 0), COUNT(*), "
+            "COALESCE(SUM(stock_level != 'ok'), 0), COALESCE(SUM(stock_level = 'critical'), 0) "
+            "FROM products"
+        ).fetchone()
+        return {"totalValue": float(row[0]), "productCount": row[1],
+                "lowStockCount": row[2], "criticalCount": row[3]}
+
+    # ---- transactions ----
+    def apply_movement(self, product_id, ttype, qty, user):
+        if ttype not in ("IN", "OUT"):
+            return None, "transaction_type must be IN or OUT", 400
+        if qty <= 0:
+            return None, "Quantity must be positive", 400
+        pid = self.parse_id(product_id)
+        if pid is None:
+            return None, "Product not found", 404
+
+        delta = qty if ttype == "IN" else -qty
+        with self.write() as conn:
+            moved = conn.execute(MOVE_SQL, {"delta": delta, "id": pid}).fetchone()
+            if moved is None:
+                exists = conn.execute("SELECT 1 FROM products WHERE id = ?", (pid,)).fetchone()
+                return (None, "Insufficient stock", 400) if exists else (None, "Product not found", 404)
+            row = {"product_id": pid, "productName": moved["name"], "type": ttype,
+                   "quantity": qty, "date": self.clock(), "user": user}
+            conn.execute(TRANSACTION_INSERT_SQL, dict(row, date=to_text(row["date"])))
+        return row, None, 200
+
+    def insert_transactions(self, rows):
+        with self.write() as conn:
+            conn.executemany(TRANSACTION_INSERT_SQL, (dict(r, date=to_text(r["date"])) for r in rows))
+
+    def transaction_where(self, spec):
+        where, params = [], {}
+        for f in ("product_id", "type", "user"):
+            if spec.get(f) is not None:
+                where.append(f"t.{f} = :{f}")
+                params[f] = spec[f]
+        if spec.get("from"):
+            where.append("t.date >= :date_from")
+            params["date_from"] = to_text(spec["from"])
+        if spec.get("to"):
+            where.append("t.date < :date_to")
+            params["date_to"] = to_text(spec["to"])
+        if spec.get("before"):
+            where.append("(t.date, t.id) < (:before_date, :before_id)")
+            params["before_date"] = to_text(spec["before"][0])
+            params["before_id"] = spec["before"][1]
+        return (" WHERE " + " AND ".join(where)) if where else "", params
+
+    def find_transactions(self, spec, limit):
+        where, params = self.transaction_where(spec)
+        params["limit"] = limit
+        sql = TRANSACTION_SELECT + where + " ORDER BY t.date DESC, t.id DESC LIMIT :limit"
+        return [transaction_doc(r) for r in self.conn().execute(sql, params)]
+
+    def iter_transactions(self, spec):
+        where, params = self.transaction_where(spec)
+        # The export keeps the name recorded on the row, as the MongoDB export does
+        sql = ("SELECT t.id, t.product_id, t.product_name, t.type, t.quantity, t.date, t.user "
+               "FROM transactions t" + where + " ORDER BY t.date, t.id")
+        return (transaction_doc(r) for r in self.conn().execute(sql, params))
+
+    def movements_today(self, day_start):
+        totals = {"inCount": 0, "outCount": 0, "inQty": 0, "outQty": 0}
+        for r in self.conn().execute(
+            "SELECT type, COUNT(*), SUM(quantity) FROM transactions WHERE date >= ? GROUP BY type",
+            (to_text(day_start),)
+        ):
+            prefix = "in" if r[0] == "IN" else "out"
+            totals[f"{prefix}Count"], totals[f"{prefix}Qty"] = r[1], r[2]
+        return totals
+
+    def counts(self):
+        conn = self.conn()
+        return {"products": conn.execute("SELECT COUNT(*) FROM products").fetchone()[0],
+                "transactions": conn.execute("SELECT COUNT(*) FROM transactions").fetchone()[0]}